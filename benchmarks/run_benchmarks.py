@@ -0,0 +1,373 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+################################################################################
+# Offline benchmarks for iTunes Local Control
+#
+# Runs the plugin against iTunesBackend.FakeMusicApp with indigo and applescript
+# stubbed out (see stubs/), so it works on any machine with python 3.
+#
+#   python3 benchmarks/run_benchmarks.py                      all scenarios, JSON to stdout
+#   python3 benchmarks/run_benchmarks.py -s fader -l 0.15     one scenario, 150 ms apple events
+#   python3 benchmarks/run_benchmarks.py -o bench_output.txt  JSON to a file
+#
+# Scenarios:
+#   actions   throughput of Plugin action methods and apple events per action
+#   settings  cost of a settings snapshot (get) and restore (set)
+#   fader     fade end-time error and step timing jitter
+#   menus     config dialog menu callback latency
+################################################################################
+
+import argparse
+import datetime
+import json
+import logging
+import math
+import os
+import platform
+import plistlib
+import statistics
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'iTunes Local Control.indigoPlugin', 'Contents')
+# stubs go first so a real applescript module is never picked up
+sys.path[:0] = [os.path.join(BENCH_DIR, 'stubs'), os.path.join(PLUGIN_DIR, 'Server Plugin')]
+
+import indigo
+import iTunesBackend
+import iTunesAppleScript as itunes
+import plugin
+
+SCENARIOS = ('actions', 'settings', 'fader', 'menus')
+
+# actions cycled through by the throughput scenario, as (callback, props)
+ACTIONS = (
+    ('play',                {}),
+    ('setVolume',           {'volume':'40'}),
+    ('increaseVolume',      {'volume':'5'}),
+    ('next',                {}),
+    ('shuffleStateToggle',  {}),
+    ('repeatAll',           {}),
+    ('eqPresetSet',         {'preset':'Rock'}),
+    ('airplayDeviceToggle', {'device':'Kitchen'}),
+    ('playPlaylist',        {'playlist':'Playlist 3'}),
+    ('decreaseVolume',      {'volume':'5'}),
+    ('pause',               {}),
+    )
+
+################################################################################
+# fake music app
+################################################################################
+def latency_distribution(name, mean, spread):
+    # returns a callable for FakeMusicApp(latency=...), spread is jitter or sigma
+    if name == 'constant':
+        return lambda rng: mean
+    if name == 'uniform':
+        return lambda rng: rng.uniform(mean - spread, mean + spread)
+    if name == 'lognormal':
+        mu = math.log(mean) - spread**2/2 if mean > 0 else 0.0
+        return lambda rng: rng.lognormvariate(mu, spread) if mean > 0 else 0.0
+    if name == 'exponential':
+        return lambda rng: rng.expovariate(1/mean) if mean > 0 else 0.0
+    raise ValueError(f"unknown latency distribution '{name}'")
+
+#-------------------------------------------------------------------------------
+class RecordingMusicApp(iTunesBackend.FakeMusicApp):
+    # remembers when each master volume write took effect
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingMusicApp, self).__init__(*args, **kwargs)
+        self.volume_writes = list()
+
+    def volume_set(self, volume):
+        self.volume_writes.append((time.monotonic(), int(volume)))
+        super(RecordingMusicApp, self).volume_set(volume)
+
+#-------------------------------------------------------------------------------
+def apple_events(app):
+    return sum(app.calls.values())
+
+################################################################################
+# plugin
+################################################################################
+def start_plugin(config):
+    # failures are switched on after startup, so the startup loads always complete
+    app = RecordingMusicApp(latency=latency_distribution(config['distribution'], config['latency'], config['spread']),
+                            seed=config['seed'], playlist_count=config['playlists'], track_count=config['tracks'])
+    itunes.set_backend(iTunesBackend.FakeBackend(app))
+    itunes.cache_clear()
+    prefs = {'showDebugInfo':config['verbose'], 'warmUpScripts':False}
+    instance = plugin.Plugin('com.benchmark.itunes', 'iTunes Local Control', config['version'], prefs)
+    instance.startup()
+    wait_idle(instance)
+    app.failure_rate = config['failure_rate']
+    app.calls.clear()
+    itunes.script_stats_clear()
+    return instance, app
+
+#-------------------------------------------------------------------------------
+def wait_idle(instance, timeout=60.0):
+    # wait for the startup loads of the menus to finish
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not instance.menus.pending and all(instance.menus.updated.values()):
+            return
+        time.sleep(0.01)
+
+#-------------------------------------------------------------------------------
+def stop_plugin(instance):
+    instance.shutdown()
+
+################################################################################
+# statistics
+################################################################################
+def summary(samples, scale=1000.0):
+    # samples in seconds, summary in milliseconds by default
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    def rank(fraction):
+        return ordered[min(len(ordered)-1, int(math.ceil(fraction*len(ordered)))-1)] * scale
+    return {
+        'count': len(ordered),
+        'mean':  round(statistics.fmean(ordered) * scale, 3),
+        'stdev': round(statistics.pstdev(ordered) * scale, 3),
+        'p50':   round(rank(0.50), 3),
+        'p95':   round(rank(0.95), 3),
+        'p99':   round(rank(0.99), 3),
+        'max':   round(ordered[-1] * scale, 3),
+        }
+
+#-------------------------------------------------------------------------------
+def script_errors():
+    return sum(values['errors'] for values in itunes.script_stats().values())
+
+################################################################################
+# scenarios
+################################################################################
+def bench_actions(config):
+    instance, app = start_plugin(config)
+    try:
+        # first pass runs each action on the calling thread to time it
+        instance.dispatcher.enabled = False
+        per_action = {name:list() for name, props in ACTIONS}
+        start = time.perf_counter()
+        for i in range(config['iterations']):
+            name, props = ACTIONS[i % len(ACTIONS)]
+            call_start = time.perf_counter()
+            getattr(instance, name)(indigo.Action(name, **props))
+            per_action[name].append(time.perf_counter() - call_start)
+        sync_elapsed = time.perf_counter() - start
+        # relative volume changes are applied by the volume queue thread
+        time.sleep(0.5 + config['latency'] * 4)
+        sync_events = apple_events(app)
+        # second pass hands the same actions to the dispatcher and waits for it to drain
+        instance.dispatcher.enabled = True
+        submit_times = list()
+        start = time.perf_counter()
+        for i in range(config['iterations']):
+            name, props = ACTIONS[i % len(ACTIONS)]
+            call_start = time.perf_counter()
+            getattr(instance, name)(indigo.Action(name, **props))
+            submit_times.append(time.perf_counter() - call_start)
+        while instance.dispatcher.pending or instance.dispatcher.busy:
+            time.sleep(0.001)
+        async_elapsed = time.perf_counter() - start
+        return {
+            'actions':                 config['iterations'],
+            'seconds':                 round(sync_elapsed, 4),
+            'actions_per_second':      round(config['iterations']/sync_elapsed, 2),
+            'apple_events':            sync_events,
+            'apple_events_per_action': round(sync_events/config['iterations'], 3),
+            'latency_ms':              summary([sample for samples in per_action.values() for sample in samples]),
+            'latency_ms_by_action':    {name:summary(samples) for name, samples in per_action.items()},
+            'dispatched': {
+                'seconds':            round(async_elapsed, 4),
+                'actions_per_second': round(config['iterations']/async_elapsed, 2),
+                'submit_latency_ms':  summary(submit_times),
+                'failed':             instance.dispatcher.counts['failed'],
+                },
+            'script_errors':           script_errors(),
+            }
+    finally:
+        stop_plugin(instance)
+
+#-------------------------------------------------------------------------------
+def bench_settings(config):
+    instance, app = start_plugin(config)
+    try:
+        app.play()
+        get_times, set_times = list(), list()
+        get_events, set_events = 0, 0
+        for i in range(config['iterations']):
+            itunes.cache_clear()
+            before = apple_events(app)
+            start = time.perf_counter()
+            settings = instance.settings
+            get_times.append(time.perf_counter() - start)
+            get_events += apple_events(app) - before
+            if settings is None:
+                continue
+            itunes.cache_clear()
+            before = apple_events(app)
+            start = time.perf_counter()
+            instance.settings = settings
+            set_times.append(time.perf_counter() - start)
+            set_events += apple_events(app) - before
+        return {
+            'snapshots':             len(get_times),
+            'restores':              len(set_times),
+            'snapshot_ms':           summary(get_times),
+            'restore_ms':            summary(set_times),
+            'apple_events_per_snapshot': round(get_events/max(1, len(get_times)), 3),
+            'apple_events_per_restore':  round(set_events/max(1, len(set_times)), 3),
+            'script_errors':         script_errors(),
+            }
+    finally:
+        stop_plugin(instance)
+
+#-------------------------------------------------------------------------------
+def bench_fader(config):
+    instance, app = start_plugin(config)
+    try:
+        results = list()
+        for duration in config['fade_durations']:
+            for i in range(config['fade_repeats']):
+                instance.volume = 0
+                time.sleep(0.1)
+                app.volume_writes = list()
+                start = time.monotonic()
+                instance.fader.fade(100, duration)
+                deadline = start + duration + 10.0
+                time.sleep(min(duration, 0.1))
+                while (instance.fader.fades or instance.fader.commands) and time.monotonic() < deadline:
+                    time.sleep(0.005)
+                writes = list(app.volume_writes)
+                if not writes:
+                    continue
+                # lateness of each step against the ideal linear schedule
+                lateness = [at - (start + duration * volume / 100.0) for at, volume in writes]
+                results.append({
+                    'duration':     duration,
+                    'steps':        len(writes),
+                    'end_volume':   writes[-1][1],
+                    'end_error_ms': round((writes[-1][0] - (start + duration)) * 1000, 3),
+                    'jitter_ms':    summary([abs(value) for value in lateness]),
+                    })
+        end_errors = [result['end_error_ms']/1000 for result in results]
+        return {
+            'fades':        results,
+            'end_error_ms': summary(end_errors),
+            'apple_events': apple_events(app),
+            'script_errors': script_errors(),
+            }
+    finally:
+        stop_plugin(instance)
+
+#-------------------------------------------------------------------------------
+def bench_menus(config):
+    instance, app = start_plugin(config)
+    try:
+        results = dict()
+        for name in ('menu_playlists', 'menu_airplay_devices', 'menu_eq_presets'):
+            callback = getattr(instance, name)
+            before = apple_events(app)
+            times = list()
+            for i in range(config['iterations']):
+                start = time.perf_counter()
+                callback()
+                times.append(time.perf_counter() - start)
+            results[name] = {
+                'latency_ms':   summary(times),
+                'apple_events': apple_events(app) - before,
+                'items':        len(callback()),
+                }
+        return results
+    finally:
+        stop_plugin(instance)
+
+BENCHMARKS = {
+    'actions':  bench_actions,
+    'settings': bench_settings,
+    'fader':    bench_fader,
+    'menus':    bench_menus,
+    }
+
+################################################################################
+def plugin_version():
+    with open(os.path.join(PLUGIN_DIR, 'Info.plist'), 'rb') as f:
+        return plistlib.load(f).get('PluginVersion', 'unknown')
+
+#-------------------------------------------------------------------------------
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for iTunes Local Control")
+    parser.add_argument('-s', '--scenario', action='append', choices=SCENARIOS,
+                        help="scenario to run, may be repeated (default: all)")
+    parser.add_argument('-d', '--distribution', default='lognormal',
+                        choices=('constant','uniform','lognormal','exponential'),
+                        help="apple event latency distribution (default: lognormal)")
+    parser.add_argument('-l', '--latency', type=float, default=0.02,
+                        help="mean apple event latency in seconds (default: 0.02)")
+    parser.add_argument('--spread', type=float, default=0.5,
+                        help="uniform jitter in seconds, or lognormal sigma (default: 0.5)")
+    parser.add_argument('-f', '--failure-rate', type=float, default=0.0,
+                        help="fraction of apple events that fail (default: 0)")
+    parser.add_argument('-n', '--iterations', type=int, default=200,
+                        help="iterations for the actions, settings and menus scenarios (default: 200)")
+    parser.add_argument('--fade-durations', type=float, nargs='+', default=[1.0, 3.0],
+                        help="fade durations in seconds (default: 1 3)")
+    parser.add_argument('--fade-repeats', type=int, default=2,
+                        help="fades per duration (default: 2)")
+    parser.add_argument('--playlists', type=int, default=20)
+    parser.add_argument('--tracks', type=int, default=100, help="tracks per playlist")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('-o', '--output', help="write JSON here instead of stdout")
+    parser.add_argument('-v', '--verbose', action='store_true', help="show plugin debug logging")
+    return parser.parse_args(argv)
+
+#-------------------------------------------------------------------------------
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING, stream=sys.stderr,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    if not args.verbose:
+        logging.getLogger('Plugin').setLevel(logging.CRITICAL)
+
+    config = {
+        'distribution':   args.distribution,
+        'latency':        args.latency,
+        'spread':         args.spread,
+        'failure_rate':   args.failure_rate,
+        'iterations':     args.iterations,
+        'fade_durations': args.fade_durations,
+        'fade_repeats':   args.fade_repeats,
+        'playlists':      args.playlists,
+        'tracks':         args.tracks,
+        'seed':           args.seed,
+        'verbose':        args.verbose,
+        'version':        plugin_version(),
+        }
+    report = {
+        'benchmark':      'iTunes Local Control',
+        'plugin_version': config['version'],
+        'python':         platform.python_version(),
+        'platform':       platform.platform(),
+        'timestamp':      datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'config':         {key:value for key, value in config.items() if key not in ('verbose','version')},
+        'results':        dict(),
+        }
+    for name in args.scenario or SCENARIOS:
+        start = time.perf_counter()
+        report['results'][name] = BENCHMARKS[name](config)
+        report['results'][name]['wall_seconds'] = round(time.perf_counter() - start, 3)
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+################################################################################
+# Stand-in for py-applescript so the benchmarks never reach a real Music.app.
+# The benchmarks install iTunesBackend.FakeBackend, so nothing here is run.
+################################################################################
+
+class _MissingValue(object):
+
+    def __repr__(self):
+        return 'kMissingValue'
+
+kMissingValue = _MissingValue()
+
+#-------------------------------------------------------------------------------
+class ScriptError(Exception):
+    pass
+
+#-------------------------------------------------------------------------------
+class AppleScript(object):
+
+    def __init__(self, source=None, path=None):
+        self.source = source
+
+    def run(self, *args):
+        raise ScriptError("applescript is stubbed out in the benchmarks")
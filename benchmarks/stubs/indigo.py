@@ -0,0 +1,112 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+################################################################################
+# Minimal stand-in for the Indigo server module, enough to load plugin.py and
+# drive its actions outside of Indigo. Variable writes are counted, not stored
+# anywhere else.
+################################################################################
+
+import logging
+import os
+import tempfile
+
+#-------------------------------------------------------------------------------
+class Dict(dict):
+    pass
+
+class List(list):
+    pass
+
+################################################################################
+class _Server(object):
+    version = 'benchmark'
+
+    def __init__(self):
+        # a throwaway install folder, so files the plugin saves in its prefs folder are discarded
+        self.install_folder = tempfile.mkdtemp(prefix='indigo-benchmark-')
+        os.makedirs(os.path.join(self.install_folder, 'Preferences', 'Plugins'))
+
+    def getInstallFolderPath(self):
+        return self.install_folder
+
+    def log(self, message, isError=False):
+        logging.getLogger('Plugin').log(logging.ERROR if isError else logging.INFO, message)
+
+server = _Server()
+
+################################################################################
+class Variable(object):
+
+    def __init__(self, varId, value=''):
+        self.id    = varId
+        self.name  = f"variable{varId}"
+        self.value = value
+
+    def getValue(self, type=str):
+        if type is bool:
+            return self.value.lower() in ('true','on','yes','1')
+        return type(self.value)
+
+class _Variables(dict):
+
+    def __getitem__(self, varId):
+        if varId not in self:
+            dict.__setitem__(self, varId, Variable(varId))
+        return dict.__getitem__(self, varId)
+
+    def __iter__(self):
+        return iter(list(self.values()))
+
+    def subscribeToChanges(self):
+        pass
+
+variables = _Variables()
+variable_updates = {'count':0}
+
+class variable(object):
+
+    @staticmethod
+    def updateValue(varId, value):
+        variables[varId].value = value
+        variable_updates['count'] += 1
+
+################################################################################
+class Device(object):
+
+    def __init__(self, devId, pluginProps=None):
+        self.id          = devId
+        self.name        = f"device{devId}"
+        self.pluginProps = pluginProps or dict()
+        self.states      = dict()
+
+    def updateStatesOnServer(self, states):
+        self.states.update((state['key'], state['value']) for state in states)
+
+devices = dict()
+
+################################################################################
+class PluginBase(object):
+
+    def __init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs):
+        self.pluginId          = pluginId
+        self.pluginDisplayName = pluginDisplayName
+        self.pluginVersion     = pluginVersion
+        self.pluginPrefs       = pluginPrefs
+        self.logger            = logging.getLogger('Plugin')
+
+    def __del__(self):
+        pass
+
+    def variableUpdated(self, origVar, newVar):
+        pass
+
+    def variableDeleted(self, var):
+        pass
+
+################################################################################
+class Action(object):
+    # what Indigo passes to action callbacks
+
+    def __init__(self, description, **props):
+        self.description = description
+        self.props       = props
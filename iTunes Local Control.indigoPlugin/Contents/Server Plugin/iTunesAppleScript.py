@@ -4,16 +4,23 @@
 # iTunes Applescripts
 ################################################################################
 
-import applescript
-import inspect
+import bisect
+import collections
+import os
 import platform
+import sys
+import threading
+import time
 try:
     import indigo
+    LIST_TYPES = (list, tuple, indigo.List)
 except:
-    pass
+    LIST_TYPES = (list, tuple)
+import iTunesBackend
+from iTunesBackend import MISSING_VALUE, ScriptUnavailable
 
 
-mac_ver = tuple([int(s) for s in platform.mac_ver()[0].split(".")])
+mac_ver = tuple([int(s) for s in platform.mac_ver()[0].split(".") if s])
 if mac_ver >= (10,15):
     AS_TARGET_NAME = "Music"
 else:
@@ -23,13 +30,176 @@ AS_TIMEOUT = 6
 def set_timeout(timeout):
     global AS_TIMEOUT 
     AS_TIMEOUT = timeout
+    _backend.timeout = AS_TIMEOUT + BACKEND_GRACE
+
+################################################################################
+# script execution backend
+################################################################################
+# extra seconds a backend waits beyond the applescript timeout before giving up
+BACKEND_GRACE = 2
+
+def set_backend(backend, **kwargs):
+    # backend may be a name ('applescript', 'worker', 'fake') or an iTunesBackend.Backend
+    global _backend
+    if isinstance(backend, str):
+        if backend == _backend.name and not kwargs:
+            return _backend
+        backend = iTunesBackend.make_backend(backend, **kwargs)
+    backend.timeout = AS_TIMEOUT + BACKEND_GRACE
+    old_backend, _backend = _backend, backend
+    old_backend.close()
+    _breaker.reset()
+    return _backend
+
+#-------------------------------------------------------------------------------
+def get_backend():
+    return _backend
+
+#-------------------------------------------------------------------------------
+def _default_backend():
+    name = os.environ.get('ITUNES_BACKEND')
+    if name is None:
+        name = 'applescript' if iTunesBackend.applescript is not None else 'fake'
+    backend = iTunesBackend.make_backend(name)
+    backend.timeout = AS_TIMEOUT + BACKEND_GRACE
+    return backend
+
+_backend = _default_backend()
+
+################################################################################
+# priority lanes
+################################################################################
+# one script runs at a time; when it finishes the oldest waiting script in the
+# highest lane goes next, so an interactive command waits for at most one call
+PRIORITY_HIGH   = 0   # transport and volume commands
+PRIORITY_NORMAL = 1   # state reads and other settings
+PRIORITY_LOW    = 2   # library enumeration, single track playback, raw applescript
+PRIORITY_NAMES  = ('high', 'normal', 'low')
+
+HIGH_PRIORITY_SCRIPTS = ('launch', 'quit', 'playpause', 'play', 'pause', 'stop', 'next', 'prev', 'back',
+                         'playlist_play', 'playlist_play_id', 'track_play_id', 'player_pos_set',
+                         'volume_set', 'volumes_set', 'airplay_device_volume_set')
+LOW_PRIORITY_SCRIPTS  = ('playlists', 'playlists_index', 'airplay_devices_all', 'eq_presets',
+                         'library_track_ids', 'library_tracks_chunk', 'play_single_track', 'executeApplescriptText')
+
+def _priority(name):
+    if name in HIGH_PRIORITY_SCRIPTS:
+        return PRIORITY_HIGH
+    if name in LOW_PRIORITY_SCRIPTS:
+        return PRIORITY_LOW
+    return PRIORITY_NORMAL
+
+class _Lanes(object):
+    # reentrant, so a thread holding its turn can run further scripts without queueing
+
+    #-------------------------------------------------------------------------------
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.owner     = None
+        self.depth     = 0
+        self.waiting   = [collections.deque() for name in PRIORITY_NAMES]
+        self.waits     = [{'count':0, 'seconds':0.0, 'max':0.0} for name in PRIORITY_NAMES]
+
+    #-------------------------------------------------------------------------------
+    def acquire(self, priority):
+        start = time.monotonic()
+        with self.condition:
+            if self.owner == threading.get_ident():
+                self.depth += 1
+                return
+            ticket = object()
+            self.waiting[priority].append(ticket)
+            while self.owner is not None or self._head() is not ticket:
+                self.condition.wait()
+            self.waiting[priority].popleft()
+            self.owner = threading.get_ident()
+            self.depth = 1
+            waited = time.monotonic() - start
+            stats = self.waits[priority]
+            stats['count'] += 1
+            stats['seconds'] += waited
+            stats['max'] = max(stats['max'], waited)
+
+    #-------------------------------------------------------------------------------
+    def release(self):
+        with self.condition:
+            self.depth -= 1
+            if self.depth == 0:
+                self.owner = None
+                self.condition.notify_all()
+
+    #-------------------------------------------------------------------------------
+    def _head(self):
+        for lane in self.waiting:
+            if lane:
+                return lane[0]
+        return None
+
+_lanes = _Lanes()
+
+#-------------------------------------------------------------------------------
+def lane_stats():
+    # per lane: scripts run, mean and max seconds spent waiting for their turn
+    with _lanes.condition:
+        return {name:{'count':stats['count'],
+                      'mean':stats['seconds']/stats['count'] if stats['count'] else 0.0,
+                      'max':stats['max'],
+                      'queued':len(_lanes.waiting[priority])}
+                for priority, (name, stats) in enumerate(zip(PRIORITY_NAMES, _lanes.waits))}
+
+################################################################################
+# scripts are compiled on first use (or by warm_up) rather than at import
+_compile_lock = threading.Lock()
+_compile_counts = {'compiled':0, 'seconds':0.0}
+
+class _Script(object):
+    # script source plus the handle compiled for the backend that will run it
+    __slots__ = ('name', 'source', 'handle', 'backend', 'guarded', 'priority')
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, source, name='script', guarded=True):
+        self.name     = name
+        self.source   = source
+        self.handle   = None
+        self.backend  = None
+        self.guarded  = guarded  # subject to the circuit breaker
+        self.priority = _priority(name)
+
+    #-------------------------------------------------------------------------------
+    def prepare(self):
+        backend = _backend
+        if self.backend is not backend:
+            with _compile_lock:
+                if self.backend is not backend:
+                    start = time.perf_counter()
+                    self.handle = backend.compile(self.source, self.name)
+                    self.backend = backend
+                    _compile_counts['compiled'] += 1
+                    _compile_counts['seconds'] += time.perf_counter() - start
+        return backend
+
+    #-------------------------------------------------------------------------------
+    def run(self, *args):
+        # latency is recorded from when the script gets its turn, not from when it queued
+        backend = self.prepare()
+        _lanes.acquire(self.priority)
+        start = time.perf_counter()
+        try:
+            result = backend.execute(self.handle, self.name, args)
+        except Exception as e:
+            _record(self.name, time.perf_counter() - start, error=True, timeout=_is_timeout(e))
+            raise
+        finally:
+            _lanes.release()
+        _record(self.name, time.perf_counter() - start)
+        return result
 
 ################################################################################
 # applescript helpers
 ################################################################################
-def _make(ascript, wrap=True):
+def _make(ascript, wrap=True, name='script', guarded=True):
     if wrap: ascript = _wrap(ascript)
-    return applescript.AppleScript(source=ascript)
+    return _Script(ascript, name, guarded)
 
 #-------------------------------------------------------------------------------
 def _wrap(ascript):
@@ -45,21 +215,367 @@ def _wrap(ascript):
 
 #-------------------------------------------------------------------------------
 def _run(script_object, *args):
-    if len(args) == 1 and isinstance(args[0], (list,tuple,indigo.List)):
+    return _run_checked(script_object, *args)[1]
+
+#-------------------------------------------------------------------------------
+def _run_checked(script_object, *args):
+    # returns (success, result) so writers can tell a failed call from an empty result
+    if len(args) == 1 and isinstance(args[0], LIST_TYPES):
         args = list(args[0])
+    # the running check and the script share one turn in the script's lane
+    _lanes.acquire(script_object.priority)
+    try:
+        _last_error.error = None
+        if script_object.guarded:
+            try:
+                _breaker.check(script_object.name in LAUNCHING_SCRIPTS)
+            except ScriptUnavailable as e:
+                _record(script_object.name, 0.0, rejected=True)
+                _breaker.rejected(script_object.name)
+                _last_error.error = e
+                return False, None
+        try:
+            result = script_object.run(*args)
+            if script_object.guarded:
+                _breaker.success()
+            if script_object.name in LAUNCHING_SCRIPTS:
+                cache_clear('running')
+            return True, result
+        except Exception as e:
+            _last_error.error = e
+            if script_object.guarded:
+                _breaker.failure(_is_timeout(e))
+            _log_error(f"Applescript runtime error")
+            _log_error(f"Applescript: {script_object.name}, args: {args}")
+            _log_error(str(e))
+            return False, None
+    finally:
+        _lanes.release()
+
+#-------------------------------------------------------------------------------
+_last_error = threading.local()
+
+def last_error():
+    # the exception behind this thread's last failed call, None if it succeeded;
+    # ScriptUnavailable means the circuit breaker refused the call without running it
+    return getattr(_last_error, 'error', None)
+
+#-------------------------------------------------------------------------------
+def _log_error(message):
+    _log(message, isError=True)
+
+#-------------------------------------------------------------------------------
+def _log(message, isError=False):
     try:
-        return script_object.run(*args)
-    except Exception as e:
-        indigo.server.log(f"Applescript runtime error", isError=True)
-        indigo.server.log(f"Applescript: {inspect.stack()[1][3]}, args: {args}", isError=True)
-        indigo.server.log(str(e), isError=True)
+        indigo.server.log(message, isError=isError)
+    except NameError:
+        sys.stderr.write(message + '\n')
+
+#-------------------------------------------------------------------------------
+def _is_timeout(error):
+    # backends raise ScriptTimeout, applescript reports error -1712 (apple event timed out)
+    if isinstance(error, iTunesBackend.ScriptTimeout):
+        return True
+    return getattr(error, 'number', None) == -1712 or 'timed out' in str(error)
+
+################################################################################
+# per script latency statistics
+################################################################################
+# upper bounds in seconds of the histogram buckets, the last bucket is unbounded
+LATENCY_BUCKETS = (0.001, 0.002, 0.003, 0.005, 0.007, 0.01, 0.015, 0.02, 0.03, 0.05, 0.07, 0.1,
+                   0.15, 0.2, 0.3, 0.5, 0.7, 1.0, 1.5, 2.0, 3.0, 5.0, 7.0, 10.0)
+
+class _ScriptStats(object):
+    __slots__ = ('calls', 'errors', 'timeouts', 'rejected', 'seconds', 'max', 'buckets')
+
+    #-------------------------------------------------------------------------------
+    def __init__(self):
+        self.calls    = 0
+        self.errors   = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.seconds  = 0.0
+        self.max      = 0.0
+        self.buckets  = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    #-------------------------------------------------------------------------------
+    def percentile(self, fraction):
+        # interpolated within the bucket holding the percentile, never more than the max seen
+        rank = fraction * self.calls
+        count = 0
+        lower = 0.0
+        for upper, bucket in zip(LATENCY_BUCKETS, self.buckets):
+            if bucket and count + bucket >= rank:
+                return min(lower + (upper - lower) * (rank - count) / bucket, self.max)
+            count += bucket
+            lower = upper
+        return self.max
+
+_stats = dict()
+_stats_lock = threading.Lock()
+
+#-------------------------------------------------------------------------------
+def _record(name, seconds, error=False, timeout=False, rejected=False):
+    # rejected calls never ran, so they are counted apart from calls and latency
+    with _stats_lock:
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = _ScriptStats()
+        if rejected:
+            stats.rejected += 1
+            return
+        stats.calls += 1
+        stats.errors += error
+        stats.timeouts += timeout
+        stats.seconds += seconds
+        if seconds > stats.max:
+            stats.max = seconds
+        stats.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+#-------------------------------------------------------------------------------
+def script_stats():
+    # dict of script name -> calls, errors, timeouts, rejected and latency summary in seconds
+    with _stats_lock:
+        return {name:{
+            'calls':    stats.calls,
+            'errors':   stats.errors,
+            'timeouts': stats.timeouts,
+            'rejected': stats.rejected,
+            'mean':     stats.seconds/stats.calls if stats.calls else 0.0,
+            'p50':      stats.percentile(0.50),
+            'p95':      stats.percentile(0.95),
+            'p99':      stats.percentile(0.99),
+            'max':      stats.max,
+            } for name, stats in _stats.items()}
+
+#-------------------------------------------------------------------------------
+def script_stats_clear():
+    with _stats_lock:
+        _stats.clear()
+
+################################################################################
+# circuit breaker
+################################################################################
+# while iTunes is not running or not responding, guarded scripts fail fast with
+# ScriptUnavailable instead of each waiting out the applescript timeout
+BREAKER_TIMEOUTS = 2      # consecutive timeouts that open the breaker
+BREAKER_COOLDOWN = 10.0   # seconds to fail fast before letting one probe call through
+
+# scripts that start playback launch the app when it is closed, so the breaker
+# lets them through while it is open only because the app is not running
+LAUNCHING_SCRIPTS = ('launch', 'playpause', 'play', 'playlist_play', 'playlist_play_id', 'track_play_id',
+                     'play_single_track')
+
+class _Breaker(object):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    #-------------------------------------------------------------------------------
+    def reset(self):
+        with self.lock:
+            self.state     = 'closed'
+            self.timeouts  = 0
+            self.opened    = None
+            self.reason    = None
+            self.probing   = False
+            self.stopped   = False  # opened because the app is not running
+            self.announced = False  # a refused call has been logged since opening
+
+    #-------------------------------------------------------------------------------
+    def check(self, launches=False):
+        # raises ScriptUnavailable unless the call may go ahead
+        with self.lock:
+            if launches and (self.state == 'closed' or self.stopped):
+                return
+            if self.state == 'open' and time.monotonic() - self.opened >= BREAKER_COOLDOWN:
+                self.state = 'half_open'
+                self.probing = False
+            if self.state == 'half_open':
+                if self.probing:
+                    raise ScriptUnavailable(self.reason)
+                self.probing = True
+            elif self.state == 'open':
+                raise ScriptUnavailable(self.reason)
+        # cheap, cached, and never launches the app
+        if running() is False:
+            self.trip(f"{AS_TARGET_NAME} is not running", stopped=True)
+            raise ScriptUnavailable(self.reason)
+
+    #-------------------------------------------------------------------------------
+    def rejected(self, name):
+        # one log entry per open period, naming the first script refused
+        with self.lock:
+            first = not self.announced
+            self.announced = True
+            reason = self.reason
+        if first:
+            _log(f"Applescript: {name} not run, {reason}")
+
+    #-------------------------------------------------------------------------------
+    def success(self):
+        with self.lock:
+            recovered = self.state != 'closed'
+            self.state    = 'closed'
+            self.timeouts = 0
+            self.probing  = False
+        if recovered:
+            _log(f"{AS_TARGET_NAME} is responding again")
+
+    #-------------------------------------------------------------------------------
+    def failure(self, timeout):
+        # any reply, even an error, shows the app is responding
+        if not timeout:
+            return self.success()
+        with self.lock:
+            self.timeouts += 1
+            trip = self.state == 'half_open' or self.timeouts >= BREAKER_TIMEOUTS
+        if trip:
+            self.trip(f"{AS_TARGET_NAME} is not responding", isError=True)
+
+    #-------------------------------------------------------------------------------
+    def trip(self, reason, isError=False, stopped=False):
+        with self.lock:
+            first = self.state == 'closed'
+            self.state     = 'open'
+            self.opened    = time.monotonic()
+            self.reason    = reason
+            self.probing   = False
+            self.stopped   = stopped
+            self.announced = False
+        if first:
+            _log(f"{reason}, failing fast for {BREAKER_COOLDOWN:.0f} seconds at a time", isError=isError)
+        else:
+            _log(f"{reason} after retry, failing fast for another {BREAKER_COOLDOWN:.0f} seconds", isError=isError)
+
+_breaker = _Breaker()
+
+#-------------------------------------------------------------------------------
+def breaker_status():
+    # an open breaker whose cooldown has passed reports half_open, the next call probes
+    with _breaker.lock:
+        state = _breaker.state
+        if state == 'open' and time.monotonic() - _breaker.opened >= BREAKER_COOLDOWN:
+            state = 'half_open'
+        return {'state':state, 'reason':_breaker.reason, 'timeouts':_breaker.timeouts}
+
+################################################################################
+# read cache
+################################################################################
+# seconds a value read from iTunes stays fresh (0 disables caching for that key)
+# keys for individual airplay devices are tuples of (key, device name)
+CACHE_TTL = {
+    'running':                1.0,
+    'volume':                 1.0,
+    'player_state':           1.0,
+    'playlist':               1.0,
+    'album':                  1.0,
+    'artist':                 1.0,
+    'track':                  1.0,
+    'stream_title':           1.0,
+    'track_duration':         1.0,
+    'player_pos':             0,
+    'shuffle_state':          1.0,
+    'shuffle_mode':           1.0,
+    'repeat':                 1.0,
+    'eq_state':               1.0,
+    'eq_preset':              1.0,
+    'airplay_devices_active': 1.0,
+    'airplay_device_active':  1.0,
+    'airplay_device_volume':  1.0,
+    'playlists':              60.0,
+    'eq_presets':             60.0,
+    'airplay_devices_all':    60.0,
+    }
+LIST_CACHE_KEYS = ('playlists', 'eq_presets', 'airplay_devices_all')
+STATE_CACHE_KEYS = tuple(key for key in CACHE_TTL if key not in LIST_CACHE_KEYS and key != 'player_pos')
+
+# values that change whenever the current track or transport state changes
+TRANSPORT_KEYS = ('player_state', 'playlist', 'album', 'artist', 'track', 'stream_title', 'track_duration', 'player_pos')
+
+_cache = dict()
+_cache_lock = threading.Lock()
+_cache_counts = {'hits':0, 'misses':0}
+
+#-------------------------------------------------------------------------------
+def set_cache_ttl(ttl, *keys):
+    for key in keys:
+        CACHE_TTL[key] = float(ttl)
+    cache_clear(*keys)
+
+#-------------------------------------------------------------------------------
+def cache_stats():
+    with _cache_lock:
+        stats = dict(_cache_counts)
+        stats['entries'] = len(_cache)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits']/lookups if lookups else 0.0
+    return stats
+
+#-------------------------------------------------------------------------------
+def cache_clear(*keys):
+    # no keys clears everything, a plain key also clears its per-device entries
+    with _cache_lock:
+        if not keys:
+            _cache.clear()
+            return
+        for cache_key in list(_cache):
+            base_key = cache_key[0] if isinstance(cache_key, tuple) else cache_key
+            if cache_key in keys or base_key in keys:
+                del _cache[cache_key]
+
+#-------------------------------------------------------------------------------
+def _cache_ttl(key):
+    return CACHE_TTL.get(key[0] if isinstance(key, tuple) else key, 0)
+
+#-------------------------------------------------------------------------------
+def _cache_put(key, value):
+    ttl = _cache_ttl(key)
+    if ttl > 0:
+        with _cache_lock:
+            _cache[key] = (value, time.monotonic() + ttl)
+
+#-------------------------------------------------------------------------------
+def _cached(key, script_object, *args):
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            _cache_counts['hits'] += 1
+            return entry[0]
+        _cache_counts['misses'] += 1
+    value = _run(script_object, *args)
+    if value is not None:
+        _cache_put(key, value)
+    return value
+
+#-------------------------------------------------------------------------------
+def _write(key, value, script_object, *args):
+    return _write_checked(key, value, script_object, *args)[1]
+
+#-------------------------------------------------------------------------------
+def _write_checked(key, value, script_object, *args):
+    # write through to the cache on success, drop the entry on failure
+    success, result = _run_checked(script_object, *args)
+    if success:
+        _cache_put(key, value)
+    else:
+        cache_clear(key)
+    return success, result
+
+#-------------------------------------------------------------------------------
+def _missing_to_none(value):
+    if value == MISSING_VALUE:
+        return None
+    return value
 
 ################################################################################
 # create all the applescript objects
 ################################################################################
 _launch = _make('''
         activate
-    ''')
+    ''', guarded=False)
 
 #-------------------------------------------------------------------------------
 _quit = _make('''
@@ -69,7 +585,7 @@ _quit = _make('''
 #-------------------------------------------------------------------------------
 _running = _make('''
         return application "{}" is running
-    '''.format(AS_TARGET_NAME), wrap=False)
+    '''.format(AS_TARGET_NAME), wrap=False, guarded=False)
 
 #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 _volume_get = _make('''
@@ -126,6 +642,17 @@ _playlist_play = _make('''
         play playlist named (item 1 of args)
     ''')
 
+#-------------------------------------------------------------------------------
+_playlist_play_id = _make('''
+        play (some playlist whose persistent ID is (item 1 of args))
+    ''')
+
+#-------------------------------------------------------------------------------
+_playlists_index = _make('''
+        set the_playlists to a reference to (every playlist where special kind is none)
+        return {name of the_playlists, persistent ID of the_playlists}
+    ''')
+
 #-------------------------------------------------------------------------------
 _playlists = _make('''
     	return (get name of every playlist where special kind is none)
@@ -203,6 +730,22 @@ _player_pos_set = _make('''
         end try
     ''')
 
+#+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+_library_track_ids = _make('''
+        return persistent ID of every track of library playlist 1
+    ''')
+
+#-------------------------------------------------------------------------------
+_library_tracks_chunk = _make('''
+        set the_tracks to a reference to (tracks (item 1 of args) thru (item 2 of args) of library playlist 1)
+        return {persistent ID of the_tracks, name of the_tracks, artist of the_tracks, album of the_tracks}
+    ''')
+
+#-------------------------------------------------------------------------------
+_track_play_id = _make('''
+        play (some track of library playlist 1 whose persistent ID is (item 1 of args))
+    ''')
+
 #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 _play_single_track = _make('''
         -- get track to be played
@@ -214,20 +757,29 @@ _play_single_track = _make('''
     	end if
     	set the_track to track track_id of input_playlist
 
-        -- prep the playlist
+        -- play the track directly unless it has to play from its own playlist
+        if not (item 3 of args) then
+            play the_track with once
+            return persistent ID of the_track
+        end if
+
+        -- prep the playlist, unless the track is already its only entry
     	set single_playlist_name to "Indigo Single Track"        
     	try
     		set single_playlist to user playlist single_playlist_name
-    		delete every track of single_playlist
+            if (count tracks of single_playlist) is not 1 or persistent ID of track 1 of single_playlist is not persistent ID of the_track then
+        		delete every track of single_playlist
+                -- add track to playlist
+            	duplicate the_track to single_playlist
+            end if
     	on error
     		set single_playlist to make new playlist with properties {name:single_playlist_name}
+        	duplicate the_track to single_playlist
     	end try
 
-        -- add track to playlist
-    	duplicate the_track to single_playlist
-
         -- play track via playlist
     	play single_playlist
+        return persistent ID of the_track
     ''')
 
 #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
@@ -340,175 +892,634 @@ _airplay_device_volume_set = _make('''
         set sound volume of AirPlay device named (item 1 of args) to (item 2 of args)
     ''')
 
+#-------------------------------------------------------------------------------
+_airplay_devices_state_get = _make('''
+        set device_names to {}
+        set device_selected to {}
+        set device_volumes to {}
+        repeat with the_device in (every AirPlay device)
+            set end of device_names to name of the_device
+            set end of device_selected to selected of the_device
+            set end of device_volumes to sound volume of the_device
+        end repeat
+        return {device_names, device_selected, device_volumes}
+    ''')
+
+#-------------------------------------------------------------------------------
+_airplay_group_set = _make('''
+        set airplay_list to {}
+        repeat with i from 1 to (count of args) by 2
+            set end of airplay_list to (AirPlay device (item i of args))
+        end repeat
+        set current AirPlay devices to airplay_list
+        repeat with i from 1 to (count of args) by 2
+            if (item (i + 1) of args) is not missing value then
+                set sound volume of AirPlay device (item i of args) to (item (i + 1) of args)
+            end if
+        end repeat
+        set active_devices to {}
+        set device_volumes to {}
+        repeat with the_device in (every AirPlay device whose selected is true)
+            set end of active_devices to name of the_device
+            set end of device_volumes to sound volume of the_device
+        end repeat
+        return {active_devices, device_volumes}
+    ''')
+
+#-------------------------------------------------------------------------------
+_volumes_set = _make('''
+        repeat with i from 1 to (count of args) by 2
+            set device_name to item i of args
+            if device_name is "" then
+                set sound volume to (item (i + 1) of args)
+            else
+                set sound volume of AirPlay device named device_name to (item (i + 1) of args)
+            end if
+        end repeat
+    ''')
+
+#+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+_settings_get = _make('''
+        set the_playlist to "None"
+        set the_album to missing value
+        set the_artist to missing value
+        set the_track to missing value
+        set active_devices to missing value
+        set device_volumes to {}
+    	try
+    		set the_playlist to name of current playlist
+    	end try
+        try
+        	set the_album to album of the current track
+        end try
+        try
+        	set the_artist to artist of the current track
+        end try
+        try
+        	set the_track to name of the current track
+        end try
+        try
+            set active_devices to {}
+            repeat with the_device in (every AirPlay device whose selected is true)
+                set end of active_devices to name of the_device
+                set end of device_volumes to sound volume of the_device
+            end repeat
+        on error
+            set active_devices to missing value
+            set device_volumes to {}
+        end try
+        return {sound volume, the_playlist, the_album, the_artist, the_track, shuffle enabled, shuffle mode as string, song repeat as string, EQ enabled, name of current EQ preset as string, player state as string, active_devices, device_volumes}
+    ''')
+
+#-------------------------------------------------------------------------------
+_settings_apply = _make('''
+        set {the_volume, the_shuffle, the_mode, the_repeat, the_eq, the_preset, the_playlist, the_state} to items 1 thru 8 of args
+        if the_volume is not missing value and sound volume is not the_volume then
+            set sound volume to the_volume
+        end if
+        if the_shuffle is not missing value and shuffle enabled is not the_shuffle then
+            set shuffle enabled to the_shuffle
+        end if
+        if the_mode is not missing value and (shuffle mode as string) is not the_mode then
+        	if the_mode is "songs" then
+        		set shuffle mode to songs
+        	else if the_mode is "albums" then
+        		set shuffle mode to albums
+        	else if the_mode is "groupings" then
+        		set shuffle mode to groupings
+        	end if
+        end if
+        if the_repeat is not missing value and (song repeat as string) is not the_repeat then
+        	if the_repeat is "off" then
+        		set song repeat to off
+        	else if the_repeat is "one" then
+        		set song repeat to one
+        	else if the_repeat is "all" then
+        		set song repeat to all
+        	end if
+        end if
+        if the_eq is not missing value and EQ enabled is not the_eq then
+            set EQ enabled to the_eq
+        end if
+        if the_preset is not missing value and (name of current EQ preset as string) is not the_preset then
+            set current EQ preset to EQ preset named the_preset
+        end if
+        if (count of args) > 8 then
+            set active_names to (get name of every AirPlay device whose selected is true)
+            set same_group to ((count of active_names) is ((count of args) - 8) div 2)
+            set airplay_list to {}
+            repeat with i from 9 to (count of args) by 2
+                set end of airplay_list to (AirPlay device (item i of args))
+                if active_names does not contain (item i of args) then set same_group to false
+            end repeat
+            if not same_group then
+                set current AirPlay devices to airplay_list
+            end if
+            repeat with i from 9 to (count of args) by 2
+                set the_level to item (i + 1) of args
+                if the_level is not missing value and sound volume of AirPlay device (item i of args) is not the_level then
+                    set sound volume of AirPlay device (item i of args) to the_level
+                end if
+            end repeat
+        end if
+        if the_playlist is not missing value then
+            set current_id to missing value
+            try
+                set current_id to persistent ID of current playlist
+            end try
+            if current_id is not the_playlist or player state is stopped then
+                play (some playlist whose persistent ID is the_playlist)
+            else if the_state is "playing" and player state is paused then
+                play
+            end if
+            if the_state is "paused" and player state is playing then
+                pause
+            end if
+        end if
+        set active_devices to {}
+        set device_volumes to {}
+        repeat with the_device in (every AirPlay device whose selected is true)
+            set end of active_devices to name of the_device
+            set end of device_volumes to sound volume of the_device
+        end repeat
+        return {active_devices, device_volumes}
+    ''')
+
+#-------------------------------------------------------------------------------
+_now_playing_get = _make('''
+        set the_album to missing value
+        set the_artist to missing value
+        set the_track to missing value
+        set the_duration to missing value
+        set the_position to missing value
+        set stream_title to "None"
+        try
+        	set the_album to album of the current track
+        end try
+        try
+        	set the_artist to artist of the current track
+        end try
+        try
+        	set the_track to name of the current track
+        end try
+        try
+        	set the_duration to duration of the current track
+        end try
+        try
+        	set the_position to player position
+        end try
+    	try
+    		set stream_title to current stream title
+    	end try
+        return {the_album, the_artist, the_track, the_duration, the_position, stream_title, player state as string}
+    ''')
+
+#-------------------------------------------------------------------------------
+_status_get = _make('''
+        set the_playlist to "None"
+        set the_album to missing value
+        set the_artist to missing value
+        set the_track to missing value
+        set the_position to missing value
+        set active_devices to missing value
+    	try
+    		set the_playlist to name of current playlist
+    	end try
+        try
+        	set the_album to album of the current track
+        end try
+        try
+        	set the_artist to artist of the current track
+        end try
+        try
+        	set the_track to name of the current track
+        end try
+        try
+        	set the_position to player position
+        end try
+        try
+            set active_devices to (get name of every AirPlay device whose selected is true)
+        end try
+        return {sound volume, player state as string, the_track, the_artist, the_album, the_playlist, the_position, shuffle enabled, song repeat as string, active_devices}
+    ''')
+
+#-------------------------------------------------------------------------------
+# name each script after its variable so backends and logs can identify it,
+# which also places it in its priority lane
+for _name, _object in list(globals().items()):
+    if isinstance(_object, _Script):
+        _object.name = _name.lstrip('_')
+        _object.priority = _priority(_object.name)
+del _name, _object
+
+#-------------------------------------------------------------------------------
+def scripts():
+    return [script_object for script_object in globals().values() if isinstance(script_object, _Script)]
+
+#-------------------------------------------------------------------------------
+def warm_up():
+    # compile every script for the current backend, returns elapsed seconds
+    start = time.perf_counter()
+    for script_object in scripts():
+        try:
+            script_object.prepare()
+        except Exception as e:
+            _log_error(f"Applescript compile error: {script_object.name}")
+            _log_error(str(e))
+    return time.perf_counter() - start
+
+#-------------------------------------------------------------------------------
+def warm_up_async(callback=None):
+    # compile in a background thread, callback receives elapsed seconds
+    def _warm_up():
+        elapsed = warm_up()
+        if callback is not None:
+            callback(elapsed)
+    thread = threading.Thread(target=_warm_up, name='iTunesWarmUp', daemon=True)
+    thread.start()
+    return thread
+
+#-------------------------------------------------------------------------------
+def compile_stats():
+    with _compile_lock:
+        return dict(_compile_counts)
+
 ################################################################################
 # callable methods
 ################################################################################
 def launch():
+    cache_clear()
+    _breaker.reset()
     return _run(_launch)
 
 #-------------------------------------------------------------------------------
 def quit():
+    cache_clear()
     return _run(_quit)
 
 #-------------------------------------------------------------------------------
 def running():
-    return _run(_running)
+    return _cached('running', _running)
 
 #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 def volume_get():
-    return _run(_volume_get)
+    return _cached('volume', _volume_get)
 
 #-------------------------------------------------------------------------------
 def volume_set(volume):
-    return _run(_volume_set, volume)
+    # airplay device volumes follow the master volume
+    # returns False if the volume could not be set
+    cache_clear('airplay_device_volume')
+    return _write_checked('volume', volume, _volume_set, volume)[0]
 
 #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 def playpause():
+    cache_clear(*TRANSPORT_KEYS)
     return _run(_playpause)
 
 #-------------------------------------------------------------------------------
 def play():
+    cache_clear(*TRANSPORT_KEYS)
     return _run(_play)
 
 #-------------------------------------------------------------------------------
 def pause():
+    cache_clear(*TRANSPORT_KEYS)
     return _run(_pause)
 
 #-------------------------------------------------------------------------------
 def stop():
+    cache_clear(*TRANSPORT_KEYS)
     return _run(_stop)
 
 #-------------------------------------------------------------------------------
 def next():
+    cache_clear(*TRANSPORT_KEYS)
     return _run(_next)
 
 #-------------------------------------------------------------------------------
 def prev():
+    cache_clear(*TRANSPORT_KEYS)
     return _run(_prev)
 
 #-------------------------------------------------------------------------------
 def back():
+    cache_clear(*TRANSPORT_KEYS)
     return _run(_back)
 
 #-------------------------------------------------------------------------------
 def player_state_get():
-    return _run(_player_state_get)
+    return _cached('player_state', _player_state_get)
 
 #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 def playlist_play(playlist):
+    cache_clear(*TRANSPORT_KEYS)
     return _run(_playlist_play, playlist)
 
+#-------------------------------------------------------------------------------
+def playlist_play_id(persistent_id):
+    # play by persistent id, which is unambiguous and skips the name lookup
+    # returns False if the playlist could not be played
+    cache_clear(*TRANSPORT_KEYS)
+    return _run_checked(_playlist_play_id, persistent_id)[0]
+
 #-------------------------------------------------------------------------------
 def playlists():
-    return _run(_playlists)
+    return _cached('playlists', _playlists)
+
+#-------------------------------------------------------------------------------
+def playlists_index():
+    # names and persistent ids of all playlists in a single round trip
+    # returns a list of (name, persistent id) pairs
+    value = _run(_playlists_index)
+    if value is None:
+        return None
+    names, persistent_ids = list(value[0]), list(value[1])
+    _cache_put('playlists', names)
+    return list(zip(names, persistent_ids))
 
 #-------------------------------------------------------------------------------
 def playlist_current():
-    return _run(_playlist_current)
+    return _cached('playlist', _playlist_current)
 
 #-------------------------------------------------------------------------------
 def stream_title():
-    return _run(_stream_title)
+    return _cached('stream_title', _stream_title)
 
 ###-------------------------------------------------------------------------------
 def album_get():
-    return _run(_album_get)
+    return _cached('album', _album_get)
 
 ###-------------------------------------------------------------------------------
 def artist_get():
-    return _run(_artist_get)
+    return _cached('artist', _artist_get)
 
 ###-------------------------------------------------------------------------------
 def track_get():
-    return _run(_track_get)
+    return _cached('track', _track_get)
 
 #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 def track_duration_get():
-    return _run(_track_duration_get)
+    return _cached('track_duration', _track_duration_get)
 
 def player_pos_get():
-    return _run(_player_pos_get)
+    return _cached('player_pos', _player_pos_get)
 
 def player_pos_set(player_pos):
+    cache_clear('player_pos')
     return _run(_player_pos_set, player_pos)
 
 #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-def play_single_track(playlist, trackId):
+def library_track_ids():
+    # persistent ids of every library track, in library order, in a single round trip
+    value = _run(_library_track_ids)
+    if value is None:
+        return None
+    return list(value)
+
+#-------------------------------------------------------------------------------
+def library_tracks_chunk(first, last):
+    # properties of library tracks first..last (1-based, inclusive) in a single round trip
+    # returns a list of (persistent id, name, artist, album) tuples
+    value = _run(_library_tracks_chunk, first, last)
+    if value is None:
+        return None
+    return list(zip(*[[_missing_to_none(item) for item in column] for column in value]))
+
+#-------------------------------------------------------------------------------
+def track_play_id(persistent_id):
+    # play a library track by persistent id, returns False if it could not be played
+    cache_clear(*TRANSPORT_KEYS)
+    return _run_checked(_track_play_id, persistent_id)[0]
+
+#-------------------------------------------------------------------------------
+def play_single_track(playlist, trackId, use_playlist=False):
+    # plays the track by itself, via the "Indigo Single Track" playlist only if use_playlist
+    # returns the persistent id of the track played
     if trackId is None:
-        trackId = applescript.kMissingValue
-    return _run(_play_single_track, playlist, trackId)
+        trackId = MISSING_VALUE
+    if use_playlist:
+        cache_clear('playlists')
+    cache_clear(*TRANSPORT_KEYS)
+    return _run(_play_single_track, playlist, trackId, bool(use_playlist))
 
 #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 def shuffle_state_get():
-    return _run(_shuffle_state_get)
+    return _cached('shuffle_state', _shuffle_state_get)
 
 #-------------------------------------------------------------------------------
 def shuffle_state_set(shuffle):
-    return _run(_shuffle_state_set, shuffle)
+    return _write('shuffle_state', shuffle, _shuffle_state_set, shuffle)
 
 #-------------------------------------------------------------------------------
 def shuffle_mode_get():
-    return _run(_shuffle_mode_get)
+    return _cached('shuffle_mode', _shuffle_mode_get)
 
 #-------------------------------------------------------------------------------
 def shuffle_mode_set(shuffle):
-    return _run(_shuffle_mode_set, shuffle.lower())
+    return _write('shuffle_mode', shuffle.lower(), _shuffle_mode_set, shuffle.lower())
 
 #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 def repeat_get():
-    return _run(_repeat_get)
+    return _cached('repeat', _repeat_get)
 
 #-------------------------------------------------------------------------------
 def repeat_set(repeat):
-    return _run(_repeat_set, repeat.lower())
+    return _write('repeat', repeat.lower(), _repeat_set, repeat.lower())
 
 #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 def eq_state_get():
-    return _run(_eq_state_get)
+    return _cached('eq_state', _eq_state_get)
 
 #-------------------------------------------------------------------------------
 def eq_state_set(eq):
-    return _run(_eq_state_set, eq)
+    return _write('eq_state', eq, _eq_state_set, eq)
 
 #-------------------------------------------------------------------------------
 def eq_presets():
-    return _run(_eq_presets)
+    return _cached('eq_presets', _eq_presets)
 
 #-------------------------------------------------------------------------------
 def eq_preset_get():
-    return _run(_eq_preset_get)
+    return _cached('eq_preset', _eq_preset_get)
 
 #-------------------------------------------------------------------------------
 def eq_preset_set(preset):
-    return _run(_eq_preset_set, preset)
+    return _write('eq_preset', preset, _eq_preset_set, preset)
 
 #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 def airplay_devices_all():
-    return _run(_airplay_devices_all)
+    return _cached('airplay_devices_all', _airplay_devices_all)
 
 #-------------------------------------------------------------------------------
 def airplay_devices_active_get():
-    return _run(_airplay_devices_active_get)
+    return _cached('airplay_devices_active', _airplay_devices_active_get)
 
 #-------------------------------------------------------------------------------
 def airplay_devices_active_set(airplayDeviceList):
-    return _run(_airplay_devices_active_set, airplayDeviceList)
+    cache_clear('airplay_device_active')
+    return _write('airplay_devices_active', list(airplayDeviceList), _airplay_devices_active_set, airplayDeviceList)
 
 #-------------------------------------------------------------------------------
 def airplay_device_active_get(airplayDevice):
-    return _run(_airplay_device_active_get, airplayDevice)
+    return _cached(('airplay_device_active', airplayDevice), _airplay_device_active_get, airplayDevice)
 
 #-------------------------------------------------------------------------------
 def airplay_device_active_set(airplayDevice, airplayStatus):
-    return _run(_airplay_device_active_set, airplayDevice, airplayStatus)
+    cache_clear('airplay_devices_active')
+    # returns False if the device could not be set
+    return _write_checked(('airplay_device_active', airplayDevice), airplayStatus, _airplay_device_active_set, airplayDevice, airplayStatus)[0]
 
 #-------------------------------------------------------------------------------
 def airplay_device_volume_get(airplayDevice):
-    return _run(_airplay_device_volume_get, airplayDevice)
+    return _cached(('airplay_device_volume', airplayDevice), _airplay_device_volume_get, airplayDevice)
 
 #-------------------------------------------------------------------------------
 def airplay_device_volume_set(airplayDevice, airplayVolume):
-    return _run(_airplay_device_volume_set, airplayDevice, airplayVolume)
+    # returns False if the volume could not be set
+    return _write_checked(('airplay_device_volume', airplayDevice), airplayVolume, _airplay_device_volume_set, airplayDevice, airplayVolume)[0]
+
+#-------------------------------------------------------------------------------
+def airplay_devices_state_get():
+    # every airplay device with its selected state and volume in a single round trip
+    # returns a dict of name -> (selected, volume)
+    value = _run(_airplay_devices_state_get)
+    if value is None:
+        return None
+    names, selected, volumes = list(value[0]), list(value[1]), list(value[2])
+    _cache_put('airplay_devices_all', names)
+    _cache_put('airplay_devices_active', [name for name, active in zip(names, selected) if active])
+    for name, active, volume in zip(names, selected, volumes):
+        _cache_put(('airplay_device_active', name), active)
+        _cache_put(('airplay_device_volume', name), volume)
+    return {name:(active, volume) for name, active, volume in zip(names, selected, volumes)}
+
+#-------------------------------------------------------------------------------
+def airplay_group_set(devices):
+    # select exactly these airplay devices and set their volumes in a single round trip
+    # devices maps name -> volume (None leaves that device's volume alone)
+    # returns the resulting active devices as a dict of name -> volume
+    args = list()
+    for name, volume in devices.items():
+        args.extend([name, MISSING_VALUE if volume is None else volume])
+    cache_clear('airplay_devices_active', 'airplay_device_active', 'airplay_device_volume')
+    value = _run(_airplay_group_set, args)
+    if value is None:
+        return None
+    active_devices, device_volumes = list(value[0]), list(value[1])
+    _cache_put('airplay_devices_active', active_devices)
+    for name, volume in zip(active_devices, device_volumes):
+        _cache_put(('airplay_device_active', name), True)
+        _cache_put(('airplay_device_volume', name), volume)
+    return dict(zip(active_devices, device_volumes))
+
+#-------------------------------------------------------------------------------
+# volumes_set key for the master volume, any other key is an airplay device name
+MASTER_VOLUME = ''
+
+def volumes_set(volumes):
+    # set master and/or airplay device volumes in a single round trip
+    args = list()
+    for name, volume in volumes.items():
+        args.extend([name, volume])
+    success, result = _run_checked(_volumes_set, args)
+    for name, volume in volumes.items():
+        key = 'volume' if name == MASTER_VOLUME else ('airplay_device_volume', name)
+        if success:
+            _cache_put(key, volume)
+        else:
+            cache_clear(key)
+    if MASTER_VOLUME in volumes:
+        cache_clear(*[('airplay_device_volume', name) for name in _cached_devices() if name not in volumes])
+    return result
+
+#-------------------------------------------------------------------------------
+def _cached_devices():
+    with _cache_lock:
+        return [key[1] for key in _cache if isinstance(key, tuple) and key[0] == 'airplay_device_volume']
+
+#+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+SETTINGS_KEYS = ('volume', 'playlist', 'album', 'artist', 'track', 'shuffle_state', 'shuffle_mode',
+                 'repeat', 'eq_state', 'eq_preset', 'player_state', 'active_devices', 'device_volumes')
+
+def settings_get():
+    # all settings in a single round trip, returned as a dict keyed by SETTINGS_KEYS
+    value = _run(_settings_get)
+    if value is None:
+        return None
+    settings = dict(zip(SETTINGS_KEYS, [_missing_to_none(item) for item in value]))
+    if settings['active_devices'] is None:
+        settings['device_volumes'] = []
+    else:
+        settings['active_devices'] = list(settings['active_devices'])
+        settings['device_volumes'] = list(settings['device_volumes'])
+        _cache_put('airplay_devices_active', settings['active_devices'])
+        for name, volume in zip(settings['active_devices'], settings['device_volumes']):
+            _cache_put(('airplay_device_active', name), True)
+            _cache_put(('airplay_device_volume', name), volume)
+    for key in SETTINGS_KEYS[:-2]:
+        _cache_put(key, settings[key])
+    return settings
+
+#-------------------------------------------------------------------------------
+APPLY_KEYS = ('volume', 'shuffle_state', 'shuffle_mode', 'repeat', 'eq_state', 'eq_preset', 'playlist_id', 'player_state')
+
+def settings_apply(settings):
+    # restore any of APPLY_KEYS plus 'devices' (name -> volume) in a single round trip; the
+    # script compares each field with the app before writing it, so everything is sent
+    # the playlist is only played if 'player_state' is playing or paused
+    # returns the resulting airplay group as a dict of name -> volume, or None on failure
+    args = [MISSING_VALUE if settings.get(key) is None else settings[key] for key in APPLY_KEYS]
+    if settings.get('playlist_id') is None:
+        args[APPLY_KEYS.index('player_state')] = MISSING_VALUE
+    for name, volume in (settings.get('devices') or dict()).items():
+        args.extend([name, MISSING_VALUE if volume is None else volume])
+    keys = [key for key in APPLY_KEYS[:6] if settings.get(key) is not None]
+    cache_clear('airplay_devices_active', 'airplay_device_active', 'airplay_device_volume')
+    if settings.get('playlist_id') is not None:
+        cache_clear(*TRANSPORT_KEYS)
+    success, value = _run_checked(_settings_apply, args)
+    if not success or value is None:
+        cache_clear(*keys)
+        return None
+    for key in keys:
+        _cache_put(key, settings[key])
+    active_devices, device_volumes = list(value[0]), list(value[1])
+    _cache_put('airplay_devices_active', active_devices)
+    for name, volume in zip(active_devices, device_volumes):
+        _cache_put(('airplay_device_active', name), True)
+        _cache_put(('airplay_device_volume', name), volume)
+    return dict(zip(active_devices, device_volumes))
+
+#-------------------------------------------------------------------------------
+NOW_PLAYING_KEYS = ('album', 'artist', 'track', 'track_duration', 'player_pos', 'stream_title', 'player_state')
+
+def now_playing_get():
+    # current track metadata in a single round trip, returned as a dict keyed by NOW_PLAYING_KEYS
+    value = _run(_now_playing_get)
+    if value is None:
+        return None
+    now_playing = dict(zip(NOW_PLAYING_KEYS, [_missing_to_none(item) for item in value]))
+    for key in NOW_PLAYING_KEYS:
+        _cache_put(key, now_playing[key])
+    return now_playing
+
+#-------------------------------------------------------------------------------
+STATUS_KEYS = ('volume', 'player_state', 'track', 'artist', 'album', 'playlist', 'player_pos',
+               'shuffle_state', 'repeat', 'active_devices')
+
+def status_get():
+    # player status for polling in a single round trip, returned as a dict keyed by STATUS_KEYS
+    value = _run(_status_get)
+    if value is None:
+        return None
+    status = dict(zip(STATUS_KEYS, [_missing_to_none(item) for item in value]))
+    if status['active_devices'] is not None:
+        status['active_devices'] = list(status['active_devices'])
+        _cache_put('airplay_devices_active', status['active_devices'])
+    for key in STATUS_KEYS[:-1]:
+        _cache_put(key, status[key])
+    return status
 
 #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 def playApplescriptSpecifier(specifier):
@@ -516,5 +1527,7 @@ def playApplescriptSpecifier(specifier):
 
 #-------------------------------------------------------------------------------
 def executeApplescriptText(appleScriptText):
-    applescriptObject = _make(appleScriptText)
+    # arbitrary script may change anything
+    cache_clear()
+    applescriptObject = _make(appleScriptText, name='executeApplescriptText')
     return _run(applescriptObject)
@@ -0,0 +1,558 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+################################################################################
+# Script execution backends used by iTunesAppleScript
+#   applescript: compile and run in the plugin process (default)
+#   worker:      run in a long-lived child process that can be killed if it hangs
+#   fake:        pure python simulation of the music app for testing without a Mac
+################################################################################
+
+import json
+import os
+import random
+import select
+import subprocess
+import sys
+import threading
+import time
+try:
+    import applescript
+except ImportError:
+    applescript = None
+
+MISSING_VALUE = getattr(applescript, 'kMissingValue', None)
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'iTunesWorker.py')
+
+################################################################################
+class ScriptTimeout(Exception):
+    pass
+
+################################################################################
+class ScriptError(Exception):
+    pass
+
+################################################################################
+class ScriptUnavailable(Exception):
+    # raised without running the script while the circuit breaker is open
+    pass
+
+################################################################################
+class Backend(object):
+    name = None
+
+    #-------------------------------------------------------------------------------
+    def __init__(self):
+        self.timeout = None
+
+    #-------------------------------------------------------------------------------
+    def compile(self, source, name):
+        # return a handle that execute() will receive
+        return source
+
+    #-------------------------------------------------------------------------------
+    def execute(self, handle, name, args):
+        raise NotImplementedError
+
+    #-------------------------------------------------------------------------------
+    def close(self):
+        pass
+
+################################################################################
+class AppleScriptBackend(Backend):
+    name = 'applescript'
+
+    #-------------------------------------------------------------------------------
+    def compile(self, source, name):
+        return applescript.AppleScript(source=source)
+
+    #-------------------------------------------------------------------------------
+    def execute(self, handle, name, args):
+        return handle.run(*args)
+
+################################################################################
+class WorkerBackend(Backend):
+    name = 'worker'
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, python=None):
+        super(WorkerBackend, self).__init__()
+        self.python   = python or sys.executable
+        self.process  = None
+        self.buffer   = b''
+        self.restarts = 0
+        self.lock     = threading.Lock()
+
+    #-------------------------------------------------------------------------------
+    def execute(self, handle, name, args):
+        request = json.dumps({'source':handle, 'args':encode(args)}) + '\n'
+        with self.lock:
+            if self.process is None or self.process.poll() is not None:
+                self._spawn()
+            try:
+                self.process.stdin.write(request.encode('utf-8'))
+                self.process.stdin.flush()
+                line = self._readline(self.timeout)
+            except (OSError, ScriptTimeout):
+                # worker is hung or gone: kill it so the next call gets a fresh one
+                self._kill()
+                self.restarts += 1
+                raise
+        reply = json.loads(line)
+        if reply['ok']:
+            return reply['result']
+        raise ScriptError(reply['error'])
+
+    #-------------------------------------------------------------------------------
+    def close(self):
+        with self.lock:
+            self._kill()
+
+    #-------------------------------------------------------------------------------
+    def _spawn(self):
+        self._kill()
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(path for path in sys.path if path)
+        self.process = subprocess.Popen([self.python, WORKER_SCRIPT], env=env,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self.buffer = b''
+
+    #-------------------------------------------------------------------------------
+    def _kill(self):
+        if self.process is not None:
+            try:
+                self.process.kill()
+                self.process.wait(1)
+            except Exception:
+                pass
+            self.process = None
+        self.buffer = b''
+
+    #-------------------------------------------------------------------------------
+    def _readline(self, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        fd = self.process.stdout.fileno()
+        while b'\n' not in self.buffer:
+            wait = None if deadline is None else deadline - time.monotonic()
+            if wait is not None and wait <= 0:
+                raise ScriptTimeout(f"worker did not respond within {timeout} seconds")
+            ready, _, _ = select.select([fd], [], [], wait)
+            if ready:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    raise OSError("worker process exited")
+                self.buffer += chunk
+        line, self.buffer = self.buffer.split(b'\n', 1)
+        return line.decode('utf-8')
+
+################################################################################
+class FakeBackend(Backend):
+    name = 'fake'
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, app=None):
+        super(FakeBackend, self).__init__()
+        self.app = app or FakeMusicApp()
+
+    #-------------------------------------------------------------------------------
+    def compile(self, source, name):
+        return None
+
+    #-------------------------------------------------------------------------------
+    def execute(self, handle, name, args):
+        return self.app.call(name, args)
+
+################################################################################
+class FakeMusicApp(object):
+    # in-memory stand-in for Music.app; each public method matches the name of
+    # a script in iTunesAppleScript and returns what that script would return
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, latency=0.0, jitter=0.0, failure_rate=0.0, playlist_count=10, track_count=25,
+                 airplay_devices=('Computer','Kitchen','Living Room','Bedroom','Office','Patio'), seed=None):
+        self.latency        = latency
+        self.jitter         = jitter
+        self.failure_rate   = failure_rate
+        self.random         = random.Random(seed)
+        self.lock           = threading.Lock()
+        self.calls          = dict()
+        self.is_running     = True
+        self.volume         = 50
+        self.state          = 'stopped'
+        self.shuffle        = False
+        self.shuffle_mode   = 'songs'
+        self.repeat         = 'off'
+        self.eq_enabled     = False
+        self.presets        = ['Flat','Acoustic','Classical','Dance','Jazz','Rock','Spoken Word']
+        self.eq_preset      = 'Flat'
+        self.position       = 0.0
+        self.started        = None
+        self.library        = dict()
+        for p in range(playlist_count):
+            name = f"Playlist {p+1}"
+            self.library[name] = [{'name':f"Track {p+1}-{t+1}", 'artist':f"Artist {t%7+1}", 'album':f"Album {p+1}",
+                                   'duration':180.0+t, 'id':f"{p+1:08X}{t+1:08X}"} for t in range(track_count)]
+        self.playlist_ids   = dict()
+        self.single_track_rebuilds = 0
+        self.playlist       = None
+        self.track          = None
+        self.airplay        = {name:{'selected':name == 'Computer', 'volume':100} for name in airplay_devices}
+
+    #-------------------------------------------------------------------------------
+    def call(self, name, args):
+        # the real app handles one apple event at a time
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if callable(self.latency):
+                # a latency distribution, called with this app's random.Random
+                time.sleep(max(0.0, self.latency(self.random)))
+            elif self.latency or self.jitter:
+                time.sleep(max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter)))
+            if self.failure_rate and self.random.random() < self.failure_rate:
+                raise ScriptError(f"simulated failure in '{name}'")
+            method = getattr(self, name, None)
+            if method is None or name.startswith('_') or name == 'call':
+                raise ScriptError(f"fake music app does not implement '{name}'")
+            return method(*args)
+
+    #-------------------------------------------------------------------------------
+    def _current(self, key):
+        if self.track is None:
+            return None
+        return self.track[key]
+
+    #-------------------------------------------------------------------------------
+    def _playlist_id(self, name):
+        if name not in self.playlist_ids:
+            self.playlist_ids[name] = f"{self.random.getrandbits(64):016X}"
+        return self.playlist_ids[name]
+
+    #-------------------------------------------------------------------------------
+    def _library_tracks(self):
+        # every track once, like library playlist 1
+        tracks = dict()
+        for name, playlist in self.library.items():
+            if name != 'Indigo Single Track':
+                for track in playlist:
+                    tracks.setdefault(track.setdefault('id', f"{self.random.getrandbits(64):016X}"), track)
+        return list(tracks.values())
+
+    #-------------------------------------------------------------------------------
+    def _position(self):
+        if self.state == 'playing' and self.started is not None:
+            return self.position + time.monotonic() - self.started
+        return self.position
+
+    #-------------------------------------------------------------------------------
+    def _start(self, playlist, index=0):
+        # starting playback launches the app, like telling Music to play does
+        self.is_running = True
+        self.playlist = playlist
+        self.track = self.library[playlist][index]
+        self.position = 0.0
+        self.started = time.monotonic()
+        self.state = 'playing'
+
+    #-------------------------------------------------------------------------------
+    def _step(self, offset):
+        if self.playlist is None:
+            return
+        tracks = self.library[self.playlist]
+        index = (tracks.index(self.track) + offset) % len(tracks)
+        self._start(self.playlist, index)
+
+    #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+    def launch(self):
+        self.is_running = True
+
+    def quit(self):
+        self.is_running = False
+        self.state = 'stopped'
+
+    def running(self):
+        return self.is_running
+
+    def volume_get(self):
+        return self.volume
+
+    def volume_set(self, volume):
+        self.volume = int(volume)
+
+    #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+    def playpause(self):
+        if self.state == 'playing':
+            self.pause()
+        else:
+            self.play()
+
+    def play(self):
+        self.is_running = True
+        if self.track is None and self.library:
+            self._start(sorted(self.library)[0])
+        elif self.state != 'playing':
+            self.started = time.monotonic()
+            self.state = 'playing'
+
+    def pause(self):
+        if self.state == 'playing':
+            self.position = self._position()
+            self.state = 'paused'
+
+    def stop(self):
+        self.state = 'stopped'
+        self.position = 0.0
+
+    def next(self):
+        self._step(1)
+
+    def prev(self):
+        self._step(-1)
+
+    def back(self):
+        self.position = 0.0
+        self.started = time.monotonic()
+
+    def player_state_get(self):
+        return self.state
+
+    #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+    def playlist_play(self, name):
+        if name not in self.library:
+            raise ScriptError(f"playlist '{name}' not found")
+        self._start(name)
+
+    def playlist_play_id(self, persistent_id):
+        for name in self.library:
+            if self._playlist_id(name) == persistent_id:
+                return self._start(name)
+        raise ScriptError(f"playlist id '{persistent_id}' not found")
+
+    def playlists(self):
+        return list(self.library)
+
+    def playlists_index(self):
+        names = list(self.library)
+        return [names, [self._playlist_id(name) for name in names]]
+
+    def playlist_current(self):
+        return self.playlist or "None"
+
+    def album_get(self):
+        return self._current('album')
+
+    def artist_get(self):
+        return self._current('artist')
+
+    def track_get(self):
+        return self._current('name')
+
+    def stream_title(self):
+        return "None"
+
+    def track_duration_get(self):
+        return self._current('duration')
+
+    def player_pos_get(self):
+        return self._position()
+
+    def player_pos_set(self, position):
+        if self.state in ('playing','paused'):
+            self.position = float(position)
+            self.started = time.monotonic()
+
+    def library_track_ids(self):
+        return [track['id'] for track in self._library_tracks()]
+
+    def library_tracks_chunk(self, first, last):
+        tracks = self._library_tracks()[first-1:last]
+        return [[track[key] for track in tracks] for key in ('id','name','artist','album')]
+
+    def track_play_id(self, persistent_id):
+        for name, playlist in self.library.items():
+            for index, track in enumerate(playlist):
+                if track.get('id') == persistent_id:
+                    return self._start(name, index)
+        raise ScriptError(f"track id '{persistent_id}' not found")
+
+    def play_single_track(self, playlist, track_id, use_playlist=False):
+        tracks = self.library[playlist]
+        if track_id in (None, MISSING_VALUE):
+            track = self.random.choice(tracks)
+        elif isinstance(track_id, int):
+            track = tracks[track_id-1]
+        else:
+            track = [t for t in tracks if t['name'] == track_id][0]
+        if not use_playlist:
+            self._start(playlist, tracks.index(track))
+            return track.get('id')
+        if self.library.get('Indigo Single Track') != [track]:
+            self.library['Indigo Single Track'] = [track]
+            self.single_track_rebuilds += 1
+        self._start('Indigo Single Track')
+        return track.get('id')
+
+    #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+    def shuffle_state_get(self):
+        return self.shuffle
+
+    def shuffle_state_set(self, shuffle):
+        self.shuffle = bool(shuffle)
+
+    def shuffle_mode_get(self):
+        return self.shuffle_mode
+
+    def shuffle_mode_set(self, mode):
+        if mode not in ('songs','albums','groupings'):
+            raise ScriptError(f"invalid shuffle mode '{mode}'")
+        self.shuffle_mode = mode
+
+    def repeat_get(self):
+        return self.repeat
+
+    def repeat_set(self, repeat):
+        if repeat not in ('off','one','all'):
+            raise ScriptError(f"invalid repeat '{repeat}'")
+        self.repeat = repeat
+
+    def eq_state_get(self):
+        return self.eq_enabled
+
+    def eq_state_set(self, eq):
+        self.eq_enabled = bool(eq)
+
+    def eq_presets(self):
+        return list(self.presets)
+
+    def eq_preset_get(self):
+        return self.eq_preset
+
+    def eq_preset_set(self, preset):
+        if preset not in self.presets:
+            raise ScriptError(f"EQ preset '{preset}' not found")
+        self.eq_preset = preset
+
+    #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+    def _device(self, name):
+        if name not in self.airplay:
+            raise ScriptError(f"AirPlay device '{name}' not found")
+        return self.airplay[name]
+
+    def airplay_devices_all(self):
+        return list(self.airplay)
+
+    def airplay_devices_active_get(self):
+        return [name for name, device in self.airplay.items() if device['selected']]
+
+    def airplay_devices_active_set(self, *names):
+        for name in names:
+            self._device(name)
+        for name, device in self.airplay.items():
+            device['selected'] = name in names
+
+    def airplay_device_active_get(self, name):
+        return self._device(name)['selected']
+
+    def airplay_device_active_set(self, name, selected):
+        self._device(name)['selected'] = bool(selected)
+
+    def airplay_device_volume_get(self, name):
+        return self._device(name)['volume']
+
+    def airplay_device_volume_set(self, name, volume):
+        self._device(name)['volume'] = int(volume)
+
+    def airplay_devices_state_get(self):
+        names = list(self.airplay)
+        return [names, [self.airplay[name]['selected'] for name in names], [self.airplay[name]['volume'] for name in names]]
+
+    def airplay_group_set(self, *args):
+        names, volumes = args[0::2], args[1::2]
+        self.airplay_devices_active_set(*names)
+        for name, volume in zip(names, volumes):
+            if volume not in (None, MISSING_VALUE):
+                self.airplay_device_volume_set(name, volume)
+        active = self.airplay_devices_active_get()
+        return [active, [self.airplay[name]['volume'] for name in active]]
+
+    def volumes_set(self, *args):
+        for name, volume in zip(args[0::2], args[1::2]):
+            if name == '':
+                self.volume_set(volume)
+            else:
+                self.airplay_device_volume_set(name, volume)
+
+    #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+    def settings_get(self):
+        active = self.airplay_devices_active_get()
+        return [self.volume, self.playlist_current(), self.album_get(), self.artist_get(), self.track_get(),
+                self.shuffle, self.shuffle_mode, self.repeat, self.eq_enabled, self.eq_preset, self.state,
+                active, [self.airplay[name]['volume'] for name in active]]
+
+    def settings_apply(self, *args):
+        volume, shuffle, mode, repeat, eq, preset, playlist_id, state = [None if arg == MISSING_VALUE else arg for arg in args[:8]]
+        if volume is not None:
+            self.volume_set(volume)
+        if shuffle is not None:
+            self.shuffle = bool(shuffle)
+        if mode is not None:
+            self.shuffle_mode = mode
+        if repeat is not None:
+            self.repeat = repeat
+        if eq is not None:
+            self.eq_enabled = bool(eq)
+        if preset is not None:
+            if preset not in self.presets:
+                raise ScriptError(f"EQ preset '{preset}' not found")
+            self.eq_preset = preset
+        if len(args) > 8:
+            self.airplay_group_set(*args[8:])
+        if playlist_id is not None:
+            if self.playlist is None or self._playlist_id(self.playlist) != playlist_id or self.state == 'stopped':
+                self.playlist_play_id(playlist_id)
+            elif state == 'playing':
+                self.play()
+            if state == 'paused':
+                self.pause()
+        active = self.airplay_devices_active_get()
+        return [active, [self.airplay[name]['volume'] for name in active]]
+
+    def now_playing_get(self):
+        return [self.album_get(), self.artist_get(), self.track_get(), self.track_duration_get(),
+                self.player_pos_get(), self.stream_title(), self.state]
+
+    def status_get(self):
+        return [self.volume, self.state, self.track_get(), self.artist_get(), self.album_get(), self.playlist_current(),
+                self.player_pos_get(), self.shuffle, self.repeat, self.airplay_devices_active_get()]
+
+    #-------------------------------------------------------------------------------
+    def executeApplescriptText(self, *args):
+        return None
+
+################################################################################
+# the worker wire format, shared with iTunesWorker (missing value is sent as null)
+################################################################################
+def encode(value):
+    if isinstance(value, (list, tuple)):
+        return [encode(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key):encode(item) for key, item in value.items()}
+    if value is None or value == MISSING_VALUE:
+        return None
+    if isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+#-------------------------------------------------------------------------------
+def decode(value):
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+    if value is None:
+        return MISSING_VALUE
+    return value
+
+#-------------------------------------------------------------------------------
+def make_backend(name, **kwargs):
+    for backend_class in (AppleScriptBackend, WorkerBackend, FakeBackend):
+        if backend_class.name == name:
+            return backend_class(**kwargs)
+    raise ValueError(f"unknown script backend '{name}'")
@@ -0,0 +1,37 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+################################################################################
+# Worker process for iTunesBackend.WorkerBackend
+# Reads one JSON request per line from stdin: {"source": ..., "args": [...]}
+# Writes one JSON reply per line to stdout: {"ok": true, "result": ...}
+#                                       or: {"ok": false, "error": "..."}
+################################################################################
+
+import json
+import sys
+import applescript
+from iTunesBackend import encode, decode
+
+# compiled scripts keyed by source, so each script is only compiled once per worker
+_compiled = dict()
+
+#-------------------------------------------------------------------------------
+def _execute(request):
+    source = request['source']
+    script_object = _compiled.get(source)
+    if script_object is None:
+        script_object = _compiled[source] = applescript.AppleScript(source=source)
+    return script_object.run(*decode(request['args']))
+
+#-------------------------------------------------------------------------------
+def main():
+    for line in sys.stdin:
+        try:
+            reply = {'ok':True, 'result':encode(_execute(json.loads(line)))}
+        except Exception as e:
+            reply = {'ok':False, 'error':str(e)}
+        sys.stdout.write(json.dumps(reply) + '\n')
+        sys.stdout.flush()
+
+if __name__ == '__main__':
+    main()
@@ -17,10 +17,17 @@ import sys
 import os
 import platform
 import time
-import threading  #only needed for Fader
-import queue      #only needed for Fader
+import math
+import threading
+import functools
+import contextlib
+import difflib
+import json
+import re
 from ast import literal_eval as literal
+_import_start = time.perf_counter()
 import iTunesAppleScript as itunes
+IMPORT_TIME = time.perf_counter() - _import_start
 
 # Note the "indigo" module is automatically imported and made available inside
 # our global name space by the host process.
@@ -29,7 +36,88 @@ import iTunesAppleScript as itunes
 # globals
 
 MIN_STEP_TIME = 0.2
-MAX_LOOP_TIME = 0.05
+
+# fade curves as fraction of the volume change at fraction of the fade time (for fades up)
+FADE_CURVES = {
+    'linear':      lambda t: t,
+    'logarithmic': lambda t: math.log10(1 + 9*t),
+    'equal_power': lambda t: math.sin(t*math.pi/2),
+    }
+# weight of the newest round trip in the fader's running latency estimate
+LATENCY_WEIGHT = 0.3
+# fade steps due within this many seconds of each other are sent together
+COALESCE_WINDOW = 0.05
+
+# music player device poll intervals (seconds)
+POLL_DEFAULTS = {
+    'pollPlaying':    2.0,
+    'pollStopped':    10.0,
+    'pollNotRunning': 30.0,
+    }
+POLL_IDLE = 60.0
+
+# seconds the airplay registry trusts its locally tracked device state
+AIRPLAY_STATE_TIME = 5.0
+
+# config dialog menus are served from memory and refreshed in the background
+MENU_STALE_TIME = 300.0   # seconds before a menu list is refreshed when used
+MENU_REFRESH_MIN = 15.0   # minimum seconds between refreshes of the same list
+
+# local track index, built in chunks and refreshed incrementally when a query finds it stale
+TRACK_INDEX_TIME = 600.0
+TRACK_CHUNK_SIZE = 500
+TRACK_FIELD_WEIGHTS = (3.0, 2.0, 1.0)  # name, artist, album
+
+# seconds the volume queue trusts its own last written volume before reading it again
+VOLUME_TRACK_TIME = 2.0
+
+# now playing values and the action fields that select their variables
+NOW_PLAYING_FIELDS = {
+    'album':          'albumVariable',
+    'artist':         'artistVariable',
+    'track':          'trackVariable',
+    'track_duration': 'trackDurationVariable',
+    'player_pos':     'playerPosVariable',
+    'stream_title':   'streamTitleVariable',
+    'player_state':   'playerStateVariable',
+    }
+
+# settings snapshots are stored as compact json with short keys and a schema version;
+# active airplay devices and their volumes are stored together as 'ad'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_KEYS = {
+    'volume':        'vo',
+    'playlist':      'pl',
+    'album':         'al',
+    'artist':        'ar',
+    'track':         'tr',
+    'shuffle_state': 'sh',
+    'shuffle_mode':  'sm',
+    'repeat':        'rp',
+    'eq_state':      'eq',
+    'eq_preset':     'ep',
+    'player_state':  'ps',
+    }
+
+# action callbacks run on a pool of worker threads, serialized per resource
+ACTION_WORKERS = 4
+ALL_RESOURCES = ('transport', 'volume', 'eq', 'airplay:*', 'library')
+
+#-------------------------------------------------------------------------------
+def dispatch(*resources):
+    # hand the decorated action callback to the plugin's dispatcher; resources are
+    # names, or functions of the action returning a name
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, action, *args):
+            names = tuple(resource(action) if callable(resource) else resource for resource in resources)
+            self.dispatcher.submit(names, action.description, method, self, action, *args)
+        return wrapper
+    return decorator
+
+#-------------------------------------------------------------------------------
+def airplay_resource(action):
+    return 'airplay:' + action.props['device']
 
 ################################################################################
 class Plugin(indigo.PluginBase):
@@ -46,6 +134,7 @@ class Plugin(indigo.PluginBase):
     # Start and Stop
     #-------------------------------------------------------------------------------
     def startup(self):
+        startup_start = time.perf_counter()
 
         self.debug = self.pluginPrefs.get('showDebugInfo',False)
         if self.debug:
@@ -56,10 +145,21 @@ class Plugin(indigo.PluginBase):
         global MIN_STEP_TIME
         MIN_STEP_TIME = self.pluginPrefs.get('minStepTime',0.2)
         itunes.set_timeout(self.pluginPrefs.get('appleScriptTimeout',6))
+        self.setCacheTimes(self.pluginPrefs)
+        self.setBackend(self.pluginPrefs)
 
+        self.dispatcher = Dispatcher(self)
+        self.dispatcher.enabled = self.pluginPrefs.get('asyncActions',True)
+        self.poller  = Poller(self)
+        self.volume_queue = VolumeQueue(self)
         self.control = Control(self)
+        self.playlist_index = PlaylistIndex(self)
+        self.track_index = TrackIndex(self)
+        self.scenes  = SceneStore(self)
+        self.menus   = MenuCache(self)
         self.airplay = Airplay(self)
         self.fader   = Fader(self)  # inactivate Fader if you don't use it
+        indigo.variables.subscribeToChanges()  # keeps the variable writer's last written values honest
 
         spacer = " " * 35
         environment_state = f"\n"
@@ -76,11 +176,43 @@ class Plugin(indigo.PluginBase):
         self.logger.info(environment_state)
         self.logger.info("iTunes Local Control is running")
 
+        self.logger.info(f"startup time: import {IMPORT_TIME*1000:.0f} ms, plugin startup {(time.perf_counter()-startup_start)*1000:.0f} ms")
+        if self.pluginPrefs.get('warmUpScripts',True):
+            itunes.warm_up_async(self.warmUpComplete)
+
+    #-------------------------------------------------------------------------------
+    def warmUpComplete(self, elapsed):
+        stats = itunes.compile_stats()
+        self.logger.info(f"startup time: compiled {stats['compiled']} scripts in {stats['seconds']*1000:.0f} ms ({elapsed*1000:.0f} ms warm-up)")
+
     #-------------------------------------------------------------------------------
     def shutdown(self):
         self.pluginPrefs['showDebugInfo'] = self.debug
         self.pluginPrefs['minStepTime'] = MIN_STEP_TIME
+        self.dispatcher.cancel()
         self.fader.cancel()  # inactivate fader if you don't use it
+        self.poller.cancel()
+        self.volume_queue.cancel()
+        self.menus.cancel()
+        itunes.get_backend().close()
+
+    #-------------------------------------------------------------------------------
+    def deviceStartComm(self, dev):
+        self.poller.add(dev)
+
+    #-------------------------------------------------------------------------------
+    def variableUpdated(self, origVar, newVar):
+        indigo.PluginBase.variableUpdated(self, origVar, newVar)
+        variable_writer.changed(newVar.id, newVar.value)
+
+    #-------------------------------------------------------------------------------
+    def variableDeleted(self, var):
+        indigo.PluginBase.variableDeleted(self, var)
+        variable_writer.forget(var.id)
+
+    #-------------------------------------------------------------------------------
+    def deviceStopComm(self, dev):
+        self.poller.remove(dev)
 
     #-------------------------------------------------------------------------------
     # Config and Validate
@@ -91,6 +223,23 @@ class Plugin(indigo.PluginBase):
             self.logger.warning(f"Debug logging {(['disabled','enabled'][self.debug])}")
             global MIN_STEP_TIME
             MIN_STEP_TIME = self.pluginPrefs.get('minStepTime',0.2)
+            self.setCacheTimes(valuesDict)
+            self.setBackend(valuesDict)
+            self.dispatcher.enabled = valuesDict.get('asyncActions',True)
+
+    #-------------------------------------------------------------------------------
+    def setCacheTimes(self, prefs):
+        itunes.set_cache_ttl(prefs.get('stateCacheTime',1.0), *itunes.STATE_CACHE_KEYS)
+        itunes.set_cache_ttl(prefs.get('listCacheTime',60.0), *itunes.LIST_CACHE_KEYS)
+
+    #-------------------------------------------------------------------------------
+    def setBackend(self, prefs):
+        name = prefs.get('scriptBackend',itunes.get_backend().name)
+        if name == 'worker':
+            backend = itunes.set_backend(name, python=prefs.get('workerPython','') or None)
+        else:
+            backend = itunes.set_backend(name)
+        self.logger.debug(f"script backend: {backend.name}")
 
     #-------------------------------------------------------------------------------
     def validatePrefsConfigUi(self, valuesDict):
@@ -110,6 +259,25 @@ class Plugin(indigo.PluginBase):
         except:
             errorsDict['appleScriptTimeout'] = 'Must be a positive integer'
 
+        for key in ['stateCacheTime','listCacheTime']:
+            try:
+                valuesDict[key] = round(float(valuesDict[key]),2)
+                if valuesDict[key] < 0:
+                    raise ValueError
+            except:
+                errorsDict[key] = 'Must be zero or a positive number'
+
+        if len(errorsDict) > 0:
+            return (False, valuesDict, errorsDict)
+        return (True, valuesDict)
+
+    #-------------------------------------------------------------------------------
+    def validateDeviceConfigUi(self, valuesDict, typeId, devId):
+        errorsDict = indigo.Dict()
+
+        for key in POLL_DEFAULTS:
+            if not validateTextFieldNumber(valuesDict.get(key,''), numberType=float, zeroAllowed=False, negativeAllowed=False):
+                errorsDict[key] = "Must be a positive number"
 
         if len(errorsDict) > 0:
             return (False, valuesDict, errorsDict)
@@ -120,7 +288,7 @@ class Plugin(indigo.PluginBase):
         errorsDict = indigo.Dict()
 
         positiveIntegerFields = ['duration', 'trackNumber']
-        otherRequiredFields = ['variable','playlist','trackName','device','status','specifier','applescriptText']
+        otherRequiredFields = ['variable','playlist','trackName','query','scene','device','status','specifier','applescriptText']
 
         for key, value in valuesDict.items():
             if key == 'volume':
@@ -133,6 +301,10 @@ class Plugin(indigo.PluginBase):
                 if value == "":
                     errorsDict[key] = "Required"
 
+        if typeId == 'nowPlayingToVariables':
+            if not any(valuesDict.get(field, '') for field in NOW_PLAYING_FIELDS.values()):
+                errorsDict['albumVariable'] = "Select at least one variable"
+
         if len(errorsDict) > 0:
             self.logger.debug(f"\n{valuesDict}")
             return (False, valuesDict, errorsDict)
@@ -142,116 +314,151 @@ class Plugin(indigo.PluginBase):
     #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
     # Action Methods
     #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+    @dispatch(*ALL_RESOURCES)
     def launch(self, action):
         self.logger.debug(f"action '{action.description}'")
         self.onState = True
 
     #-------------------------------------------------------------------------------
+    @dispatch(*ALL_RESOURCES)
     def quit(self, action):
         self.logger.debug(f"action '{action.description}'")
         self.onState = False
 
     #-------------------------------------------------------------------------------
+    @dispatch(*ALL_RESOURCES)
     def toggle(self, action):
         self.logger.debug(f"action '{action.description}'")
         self.onState = not self.onState
 
     #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+    @dispatch('transport')
     def play(self, action):
         self.logger.debug(f"action '{action.description}'")
         self.control.play()
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport')
     def pause(self, action):
         self.logger.debug(f"action '{action.description}'")
         self.control.pause()
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport')
     def playpause(self, action):
         self.logger.debug(f"action '{action.description}'")
         self.control.playpause()
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport')
     def stop(self, action):
         self.logger.debug(f"action '{action.description}'")
         self.control.stop()
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport')
     def next(self, action):
         self.logger.debug(f"action '{action.description}'")
         self.control.next()
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport')
     def prev(self, action):
         self.logger.debug(f"action '{action.description}'")
         self.control.prev()
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport')
     def back(self, action):
         self.logger.debug(f"action '{action.description}'")
         self.control.back()
 
     #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+    @dispatch('volume')
     def setVolume(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['volume']}")
         self.volume = action.props['volume']
 
     #-------------------------------------------------------------------------------
+    @dispatch('volume')
     def increaseVolume(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['volume']}")
-        self.volume += int(action.props['volume'])
+        self.volume_queue.adjust(int(action.props['volume']))
 
     #-------------------------------------------------------------------------------
+    @dispatch('volume')
     def decreaseVolume(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['volume']}")
-        self.volume -= int(action.props['volume'])
+        self.volume_queue.adjust(-int(action.props['volume']))
 
     #-------------------------------------------------------------------------------
+    @dispatch('volume')
     def volumeToVariable(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['variable']}")
         variable_set(action.props['variable'],self.volume)
 
     #-------------------------------------------------------------------------------
+    @dispatch('volume')
     def volumeFromVariable(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['variable']}")
         self.volume = variable_get(action.props['variable'],int)
 
     #-------------------------------------------------------------------------------
+    @dispatch('volume')
     def fadeVolumeTo(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['volume']}/{action.props['duration']}s")
-        self.fadeStart(action.props['volume'], action.props['duration'])
+        self.fadeStart(action.props['volume'], action.props['duration'], action.props.get('curve','linear'))
 
     #-------------------------------------------------------------------------------
+    @dispatch('volume')
     def fadeVolumeUp(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['volume']}/{action.props['duration']}s")
-        self.fadeStart(self.volume + int(action.props['volume']), action.props['duration'])
+        self.fadeStart(self.volume + int(action.props['volume']), action.props['duration'], action.props.get('curve','linear'))
 
     #-------------------------------------------------------------------------------
+    @dispatch('volume')
     def fadeVolumeDown(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['volume']}/{action.props['duration']}s")
-        self.fadeStart(self.volume - int(action.props['volume']), action.props['duration'])
+        self.fadeStart(self.volume - int(action.props['volume']), action.props['duration'], action.props.get('curve','linear'))
 
     #-------------------------------------------------------------------------------
+    @dispatch('volume')
     def fadeFromVariable(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['variable']}")
-        self.fadeStart(variable_get(action.props['variable'],int), action.props['duration'])
+        self.fadeStart(variable_get(action.props['variable'],int), action.props['duration'], action.props.get('curve','linear'))
+
+    #-------------------------------------------------------------------------------
+    def fadeStart(self, volume, duration, curve='linear'):
+        self.volume_queue.forget()
+        self.fader.fade(volume, duration, curve)
 
     #-------------------------------------------------------------------------------
-    def fadeStart(self, volume, duration):
-        self.fader.fade(volume, duration)
+    @dispatch('volume', airplay_resource)
+    def fadeAirplayDeviceVolume(self, action):
+        self.logger.debug(f"action '{action.description}': {action.props['device']}@{action.props['volume']}/{action.props['duration']}s")
+        # device volume is a percent of master volume, as for airplayDeviceVolume
+        master_volume = itunes.volume_get()
+        if master_volume is None:
+            self.logger.error(f"action '{action.description}': cannot get master volume")
+            return
+        volume = int(normalize_volume(action.props['volume'])/100.0 * master_volume)
+        self.fader.fade(volume, action.props['duration'], action.props.get('curve','linear'), action.props['device'])
 
     #-------------------------------------------------------------------------------
+    @dispatch('volume', 'airplay:*')
     def fadeStop(self, action):
         self.logger.debug(f"action '{action.description}'")
         self.fader.stop()
 
     #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+    @dispatch('transport')
     def playPlaylist(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['playlist']}")
         self.shuffle_state = False
         self.playlist = action.props['playlist']
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport')
     def playPlaylistShuffled(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['playlist']}")
         self.shuffle_mode = 'songs'
@@ -259,212 +466,296 @@ class Plugin(indigo.PluginBase):
         self.playlist = action.props['playlist']
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport')
     def playlistToVariable(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['variable']}")
         variable_set(action.props['variable'],self.playlist)
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport')
     def playlistFromVariable(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['variable']}")
         self.playlist = variable_get(action.props['variable'])
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport')
     def albumToVariable(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['variable']}")
         variable_set(action.props['variable'],self.album)
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport')
     def artistToVariable(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['variable']}")
         variable_set(action.props['variable'],self.artist)
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport')
     def trackToVariable(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['variable']}")
         variable_set(action.props['variable'],self.track)
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport')
     def streamTitleToVariable(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['variable']}")
         variable_set(action.props['variable'],self.stream_title)
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport')
     def trackDurationToVariable(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['variable']}")
         variable_set(action.props['variable'],self.track_duration)
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport')
     def playerPosToVariable(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['variable']}")
         variable_set(action.props['variable'],self.player_pos)
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport')
     def playerPosFromVariable(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['variable']}")
         self.player_pos = variable_get(action.props['variable'], int)
 
+    #-------------------------------------------------------------------------------
+    @dispatch('transport')
+    def nowPlayingToVariables(self, action):
+        self.logger.debug(f"action '{action.description}'")
+        targets = dict()
+        for key, field in NOW_PLAYING_FIELDS.items():
+            if action.props.get(field, ''):
+                targets[key] = action.props[field]
+        if not targets:
+            return
+        now_playing = self.now_playing
+        if now_playing is None:
+            return
+        with variable_writer.batch():
+            for key, varId in targets.items():
+                variable_set(varId, now_playing[key])
+
     #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+    def singleTrackPlaylist(self, action):
+        # play via the "Indigo Single Track" playlist only when asked for; actions saved
+        # before the mode existed have no value and keep the playlist behavior
+        return action.props.get('singleTrackMode', 'playlist') == 'playlist'
+
+    #-------------------------------------------------------------------------------
+    @dispatch('transport', 'library')
     def playSingleTrackPlaylistNumber(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['playlist']} {int(action.props['trackNumber'])}")
-        itunes.play_single_track(action.props['playlist'], int(action.props['trackNumber']))
+        self.menus.check('playlists', action.props['playlist'])
+        itunes.play_single_track(action.props['playlist'], int(action.props['trackNumber']), self.singleTrackPlaylist(action))
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport', 'library')
     def playSingleTrackPlaylistName(self, action):
-        self.logger.debug(f"action '{action.description}': {action.props['playlist']} {int(action.props['trackName'])}")
-        itunes.play_single_track(action.props['playlist'], action.props['trackName'])
+        self.logger.debug(f"action '{action.description}': {action.props['playlist']} {action.props['trackName']}")
+        self.menus.check('playlists', action.props['playlist'])
+        itunes.play_single_track(action.props['playlist'], action.props['trackName'], self.singleTrackPlaylist(action))
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport', 'library')
     def playSingleTrackPlaylistRandom(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['playlist']}")
-        itunes.play_single_track(action.props['playlist'], None)
+        self.menus.check('playlists', action.props['playlist'])
+        itunes.play_single_track(action.props['playlist'], None, self.singleTrackPlaylist(action))
+
+    #-------------------------------------------------------------------------------
+    @dispatch('transport', 'library')
+    def playBestMatch(self, action):
+        self.logger.debug(f"action '{action.description}': {action.props['query']}")
+        match = self.track_index.best_match(action.props['query'])
+        if match is None:
+            self.logger.error(f"no track matches '{action.props['query']}'")
+            return
+        persistent_id, name, artist, album = match
+        self.logger.debug(f"best match: '{name}' by {artist} from {album}")
+        itunes.track_play_id(persistent_id)
+        self.poller.wake()
 
     #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+    @dispatch('transport')
     def shuffleStateOn(self, action):
         self.logger.debug(f"action '{action.description}'")
         self.shuffle_state = True
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport')
     def shuffleStateOff(self, action):
         self.logger.debug(f"action '{action.description}'")
         self.shuffle_state = False
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport')
     def shuffleStateToggle(self, action):
         self.logger.debug(f"action '{action.description}'")
         self.shuffle_state = not self.shuffle_state
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport')
     def shuffleStateToVariable(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['variable']}")
         variable_set(action.props['variable'],self.shuffle_state)
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport')
     def shuffleStateFromVariable(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['variable']}")
         self.shuffle_state = variable_get(action.props['variable'],bool)
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport')
     def shuffleModeSongs(self, action):
         self.logger.debug(f"action '{action.description}'")
         self.shuffle_mode = 'songs'
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport')
     def shuffleModeAlbums(self, action):
         self.logger.debug(f"action '{action.description}'")
         self.shuffle_mode = 'albums'
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport')
     def shuffleModeGroupings(self, action):
         self.logger.debug(f"action '{action.description}'")
         self.shuffle_mode = 'groupings'
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport')
     def shuffleModeToVariable(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['variable']}")
         variable_set(action.props['variable'],self.shuffle_mode)
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport')
     def shuffleModeFromVariable(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['variable']}")
         self.shuffle_mode = variable_get(action.props['variable'])
 
     #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+    @dispatch('transport')
     def repeatOff(self, action):
         self.logger.debug(f"action '{action.description}'")
         self.repeat = 'off'
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport')
     def repeatOne(self, action):
         self.logger.debug(f"action '{action.description}'")
         self.repeat = 'one'
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport')
     def repeatAll(self, action):
         self.logger.debug(f"action '{action.description}'")
         self.repeat = 'all'
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport')
     def repeatToVariable(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['variable']}")
         variable_set(action.props['variable'],self.repeat)
 
     #-------------------------------------------------------------------------------
+    @dispatch('transport')
     def repeatFromVariable(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['variable']}")
         self.repeat = variable_get(action.props['variable'])
 
     #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+    @dispatch('eq')
     def eqStateOn(self, action):
         self.logger.debug(f"action '{action.description}'")
         self.eq_state = True
 
     #-------------------------------------------------------------------------------
+    @dispatch('eq')
     def eqStateOff(self, action):
         self.logger.debug(f"action '{action.description}'")
         self.eq_state = False
 
     #-------------------------------------------------------------------------------
+    @dispatch('eq')
     def eqStateToggle(self, action):
         self.logger.debug(f"action '{action.description}'")
         self.eq_state = not self.eq_state
 
     #-------------------------------------------------------------------------------
+    @dispatch('eq')
     def eqStateToVariable(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['variable']}")
         variable_set(action.props['variable'],self.eq_state)
 
     #-------------------------------------------------------------------------------
+    @dispatch('eq')
     def eqStateFromVariable(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['variable']}")
         self.eq_state = variable_get(action.props['variable'],bool)
 
     #-------------------------------------------------------------------------------
+    @dispatch('eq')
     def eqPresetSet(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['preset']}")
+        self.menus.check('eq_presets', action.props['preset'])
         self.eq_preset = action.props['preset']
 
     #-------------------------------------------------------------------------------
+    @dispatch('eq')
     def eqPresetToVariable(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['variable']}")
         variable_set(action.props['variable'],self.eq_preset)
 
     #-------------------------------------------------------------------------------
+    @dispatch('eq')
     def eqPresetFromVariable(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['variable']}")
         self.eq_preset = variable_get(action.props['variable'])
 
     #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+    @dispatch(airplay_resource)
     def airplayDeviceStatus(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['device']}@{action.props['volume']} {action.props['status']}")
-        self.airplay.device(action.props['device']).active = action.props['status']
-        self.airplay.device(action.props['device']).volume = action.props['volume']
+        device = self.airplay.device(action.props['device'])
+        device.active = action.props['status']
+        device.volume = action.props['volume']
 
     #-------------------------------------------------------------------------------
+    @dispatch(airplay_resource)
     def airplayDeviceAdd(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['device']}")
         self.airplay.device(action.props['device']).active = True
 
     #-------------------------------------------------------------------------------
+    @dispatch(airplay_resource)
     def airplayDeviceRemove(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['device']}")
         self.airplay.device(action.props['device']).active = False
 
     #-------------------------------------------------------------------------------
+    @dispatch(airplay_resource)
     def airplayDeviceToggle(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['device']}")
         self.airplay.device(action.props['device']).toggle()
 
     #-------------------------------------------------------------------------------
+    @dispatch(airplay_resource)
     def airplayDeviceVolume(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['device']}@{action.props['volume']}")
+        self.menus.check('airplay_devices', action.props['device'])
         self.airplay.device(action.props['device']).volume = action.props['volume']
 
     #-------------------------------------------------------------------------------
+    @dispatch('airplay:*')
     def airplayDevicesGroup(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['devices']}")
         self.airplay.active_devices = action.props['devices']
 
     #-------------------------------------------------------------------------------
+    @dispatch('airplay:*')
     def airplayDevicesToVariable(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['variable']}")
         devices = self.airplay.active_devices
@@ -474,34 +765,80 @@ class Plugin(indigo.PluginBase):
         variable_set(action.props['variable'],devices)
 
     #-------------------------------------------------------------------------------
+    @dispatch('airplay:*')
     def airplayDevicesFromVariable(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['variable']}")
-        devices = variable_get(action.props['variable'])
-        if "['" in devices: # we have a pseudo list (type is str). 
-            self.airplay.active_devices = variable_get(action.props['variable'], list)
-        else:
-            devices = variable_get(action.props['variable'], str)
-            devices = devices.split(', ')  #convert string to list
-            self.airplay.active_devices = devices
+        self.airplay.active_devices = decode_devices(variable_get(action.props['variable']))
 
     #-------------------------------------------------------------------------------
+    @dispatch(*ALL_RESOURCES)
     def currentSettingsToVariable(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['variable']}")
-        variable_set(action.props['variable'],self.settings)
+        settings = self.settings
+        if settings is not None:
+            variable_set(action.props['variable'],encode_settings(settings))
 
     #-------------------------------------------------------------------------------
+    @dispatch(*ALL_RESOURCES)
     def currentSettingsFromVariable(self, action):
         self.logger.debug(f"action '{action.description}': {action.props['variable']}")
-        self.settings = variable_get(action.props['variable'], dict)
+        try:
+            settings = decode_settings(variable_get(action.props['variable']))
+        except (ValueError, SyntaxError) as e:
+            self.logger.error(f"action '{action.description}': variable does not hold iTunes settings ({e})")
+            return
+        self.settings = settings
+
+    #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+    @dispatch(*ALL_RESOURCES + ('scenes',))
+    def saveScene(self, action):
+        name = action.props['scene'].strip()
+        self.logger.debug(f"action '{action.description}': {name}")
+        settings = self.settings
+        if settings is not None:
+            self.scenes.store(name, settings)
+            self.logger.info(f"saved scene '{name}'")
+
+    #-------------------------------------------------------------------------------
+    @dispatch(*ALL_RESOURCES + ('scenes',))
+    def recallScene(self, action):
+        name = action.props['scene']
+        self.logger.debug(f"action '{action.description}': {name}")
+        target = self.scenes.target(name)
+        if target is None:
+            self.logger.error(f"action '{action.description}': no scene named '{name}'")
+            return
+        self.apply_target(target)
+
+    #-------------------------------------------------------------------------------
+    @dispatch('scenes')
+    def deleteScene(self, action):
+        name = action.props['scene']
+        self.logger.debug(f"action '{action.description}': {name}")
+        if self.scenes.delete(name):
+            self.logger.info(f"deleted scene '{name}'")
+        else:
+            self.logger.error(f"action '{action.description}': no scene named '{name}'")
 
     #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+    @dispatch(*ALL_RESOURCES)
     def playApplescriptSpecifier(self, action):
         itunes.playApplescriptSpecifier(action.props['specifier'])
 
     #-------------------------------------------------------------------------------
+    @dispatch(*ALL_RESOURCES)
     def executeApplescriptText(self, action):
         itunes.executeApplescriptText(action.props['applescriptText'])
 
+    #-------------------------------------------------------------------------------
+    def scriptStatsToVariable(self, action):
+        self.logger.debug(f"action '{action.description}': {action.props['variable']}")
+        stats = itunes.script_stats()
+        for values in stats.values():
+            for key in ('mean','p50','p95','p99','max'):
+                values[key] = round(values[key], 4)
+        variable_set(action.props['variable'], json.dumps(stats, sort_keys=True))
+
     #-------------------------------------------------------------------------------
     # Menu Methods
     #-------------------------------------------------------------------------------
@@ -513,19 +850,56 @@ class Plugin(indigo.PluginBase):
             self.debug = True
             self.logger.warning("Debug logging enabled")
 
+    #-------------------------------------------------------------------------------
+    def logCacheStats(self):
+        stats = itunes.cache_stats()
+        self.logger.info(f"read cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate), {stats['entries']} entries")
+        stats = variable_writer.stats()
+        self.logger.info(f"variable writes: {stats['issued']} issued, {stats['suppressed']} suppressed, {stats['entries']} variables tracked")
+
+    #-------------------------------------------------------------------------------
+    def logScriptStats(self):
+        stats = itunes.script_stats()
+        if not stats:
+            self.logger.info("script statistics: no scripts run yet")
+            return
+        lines = [f"{'script':<28} {'calls':>7} {'errors':>7} {'timeouts':>8} {'rejected':>8} {'p50':>7} {'p95':>7} {'p99':>7} {'max':>7}"]
+        for name, values in sorted(stats.items(), key=lambda item: -item[1]['p95']):
+            lines.append(f"{name:<28} {values['calls']:>7} {values['errors']:>7} {values['timeouts']:>8} {values['rejected']:>8} "
+                         f"{values['p50']*1000:>5.0f}ms {values['p95']*1000:>5.0f}ms {values['p99']*1000:>5.0f}ms {values['max']*1000:>5.0f}ms")
+        lines.append(f"{'lane':<28} {'calls':>7} {'wait mean':>10} {'wait max':>9}")
+        for name, values in itunes.lane_stats().items():
+            lines.append(f"{name:<28} {values['count']:>7} {values['mean']*1000:>8.0f}ms {values['max']*1000:>7.0f}ms")
+        self.logger.info("script statistics:\n" + "\n".join(lines))
+
+    #-------------------------------------------------------------------------------
+    def rebuildTrackIndex(self):
+        if self.track_index.refresh(full=True):
+            self.logger.info(f"track index: {len(self.track_index)} tracks")
+        else:
+            self.logger.error("track index: could not read library")
+
     #-------------------------------------------------------------------------------
     # Menu Callbacks
     #-------------------------------------------------------------------------------
     def menu_airplay_devices(self, filter='', valuesDict=dict(), typeId='', targetId=0):
-        return [(item,item) for item in self.airplay.all_devices]
+        return [(item,item) for item in self.menus.get('airplay_devices')]
+
+    #-------------------------------------------------------------------------------
+    def menu_variables(self, filter='', valuesDict=dict(), typeId='', targetId=0):
+        return [('','- none -')] + [(str(var.id),var.name) for var in indigo.variables]
 
     #-------------------------------------------------------------------------------
     def menu_playlists(self, filter='', valuesDict=dict(), typeId='', targetId=0):
-        return [(item,item) for item in self.playlists]
+        return [(item,item) for item in self.menus.get('playlists')]
+
+    #-------------------------------------------------------------------------------
+    def menu_scenes(self, filter='', valuesDict=dict(), typeId='', targetId=0):
+        return [(item,item) for item in self.scenes.names]
 
     #-------------------------------------------------------------------------------
     def menu_eq_presets(self, filter='', valuesDict=dict(), typeId='', targetId=0):
-        return [(item,item) for item in self.eq_presets]
+        return [(item,item) for item in self.menus.get('eq_presets')]
 
     #-------------------------------------------------------------------------------
     # Properties
@@ -549,9 +923,14 @@ class Plugin(indigo.PluginBase):
         return value
     def _volume_set(self, value):
         value = normalize_volume(value)
-        self.fader.stop()
+        self.fader.stop(itunes.MASTER_VOLUME)
         self.logger.debug(f"set volume: {value}")
-        itunes.volume_set(value)
+        if itunes.volume_set(value):
+            self.volume_queue.track(value)
+        else:
+            self.volume_queue.forget()
+        self.airplay.invalidate()
+        self.poller.wake()
     volume = property(_volume_get,_volume_set)
 
     #-------------------------------------------------------------------------------
@@ -568,7 +947,9 @@ class Plugin(indigo.PluginBase):
         return value
     def _playlist_set(self,value):
         self.logger.debug(f"set playlist: {value}")
-        itunes.playlist_play(value)
+        self.menus.check('playlists', value)
+        self.playlist_index.play(value)
+        self.poller.wake()
     playlist = property(_playlist_get,_playlist_set)
 
     #-------------------------------------------------------------------------------
@@ -601,19 +982,13 @@ class Plugin(indigo.PluginBase):
 
     #-------------------------------------------------------------------------------
     def _track_duration_get(self):
-        value = itunes.track_duration_get()
-        if value is None:
-            value = 0
-        value = int(round(value * 10)) # track duration in 1/10 of seconds for use by Nuvo plugin
+        value = tenths(itunes.track_duration_get()) # track duration in 1/10 of seconds for use by Nuvo plugin
         self.logger.debug(f"get track duration: {value}")
         return value
     track_duration = property(_track_duration_get)
 
     def _player_pos_get(self):
-        value = itunes.player_pos_get()
-        if value is None:
-            value = 0
-        value = int(round(value * 10)) # player position in 1/10 of seconds for use by Nuvo plugin
+        value = tenths(itunes.player_pos_get()) # player position in 1/10 of seconds for use by Nuvo plugin
         self.logger.debug(f"get player position: {value}")
         return value
     def _player_pos_set(self, value):
@@ -629,6 +1004,7 @@ class Plugin(indigo.PluginBase):
     def _shuffle_state_set(self, value):
         self.logger.debug(f"set shuffle state: {value}")
         itunes.shuffle_state_set(value)
+        self.poller.wake()
     shuffle_state = property(_shuffle_state_get,_shuffle_state_set)
 
     #-------------------------------------------------------------------------------
@@ -649,6 +1025,7 @@ class Plugin(indigo.PluginBase):
     def _repeat_set(self, value):
         self.logger.debug(f"set repeat: {value}")
         itunes.repeat_set(value)
+        self.poller.wake()
     repeat = property(_repeat_get,_repeat_set)
 
     #-------------------------------------------------------------------------------
@@ -685,48 +1062,58 @@ class Plugin(indigo.PluginBase):
         self.logger.debug(f"get player state: {value}")
         return value
 
+    #-------------------------------------------------------------------------------
+    @property
+    def now_playing(self):
+        # one batched applescript call for all current track metadata
+        value = itunes.now_playing_get()
+        if value is None:
+            self.logger.error("cannot get now playing info")
+            return None
+        value['track_duration'] = tenths(value['track_duration'])
+        value['player_pos'] = tenths(value['player_pos'])
+        self.logger.debug(f"get now playing: {value}")
+        return value
+
     #-------------------------------------------------------------------------------
     def _settings_get(self):
-        active_devices = self.airplay.active_devices
-        airplay_volume = dict()
-        for deviceName in active_devices:
-            airplay_volume[deviceName] = self.airplay.device(deviceName).volume
-        settings = {
-            'volume':         self.volume,
-            'playlist':       self.playlist,
-            'album':          self.album,
-            'artist':         self.artist,
-            'track':          self.track,
-            'shuffle_state':  self.shuffle_state,
-            'shuffle_mode':   self.shuffle_mode,
-            'repeat':         self.repeat,
-            'eq_state':       self.eq_state,
-            'eq_preset':      self.eq_preset,
-            'player_state':   self.player_state,
-            'active_devices': active_devices,
-            'airplay_volume': airplay_volume
-            }
+        # one batched applescript call regardless of the number of fields
+        settings = itunes.settings_get()
+        if settings is None:
+            self.logger.error("cannot get current settings")
+            return None
+        if settings['active_devices'] is None: #script cannot get active airplay devices
+            self.logger.debug("cannot get active airplay devices")
+            settings['active_devices'] = ['Computer']
+        device_volumes = settings.pop('device_volumes')
+        settings['airplay_volume'] = dict(zip(settings['active_devices'], device_volumes))
+        if device_volumes:
+            self.airplay.update_group(settings['airplay_volume'])
+        self.logger.debug(f"get settings: {settings}")
         return settings
     def _settings_set(self,settings):
-        self.volume        = settings['volume']
-        self.shuffle_state = settings['shuffle_state']
-        self.shuffle_mode  = settings['shuffle_mode']
-        self.repeat        = settings['repeat']
-        self.eq_state      = settings['eq_state']
-        self.eq_preset     = settings['eq_preset']
-        self.airplay.active_devices = settings['active_devices']
-        for name, volume in settings['airplay_volume'].items():
-            if settings['volume'] == 0:
-                self.airplay.device(name).volume = 0
-            else:
-                self.airplay.device(name).volume = int(round(volume*100.0/settings['volume']))
-        if settings['playlist'] in self.playlists:
-            if settings['player_state'] in ['playing','paused']:
-                itunes.playlist_play(settings['playlist'])
-            if settings['player_state'] == 'paused':
-                itunes.pause()
+        self.logger.debug(f"set settings: {settings}")
+        self.apply_target(settings_target(settings))
     settings = property(_settings_get,_settings_set)
 
+    #-------------------------------------------------------------------------------
+    def apply_target(self, target):
+        # one combined script that only changes what differs from the current settings
+        target = dict(target)
+        if target['player_state'] in ['playing','paused'] and target['playlist'] in self.playlist_index:
+            target['playlist_id'] = self.playlist_index.persistent_id(target['playlist'])
+        self.fader.stop()  # master and airplay device volumes are all restored
+        group = itunes.settings_apply(target)
+        if group is None:
+            self.logger.error("cannot restore settings")
+        else:
+            if group:
+                self.airplay.update_group(group)
+            self.volume_queue.track(target['volume'])
+        # the master volume was written too, and the reply only covers the selected devices
+        self.airplay.invalidate()
+        self.poller.wake()
+
 ################################################################################
 # Classes
 ################################################################################
@@ -735,156 +1122,897 @@ class Control(object):
     #-------------------------------------------------------------------------------
     def __init__(self, plugin):
         self.logger = plugin.logger
+        self.poller = plugin.poller
 
     #-------------------------------------------------------------------------------
     def play(self):
         self.logger.debug(f"control: play")
         itunes.play()
+        self.poller.wake()
 
     #-------------------------------------------------------------------------------
     def pause(self):
         self.logger.debug(f"control: pause")
         itunes.pause()
+        self.poller.wake()
 
     #-------------------------------------------------------------------------------
     def playpause(self):
         self.logger.debug(f"control: playpause")
         itunes.playpause()
+        self.poller.wake()
 
     #-------------------------------------------------------------------------------
     def stop(self):
         self.logger.debug(f"control: stop")
         itunes.stop()
+        self.poller.wake()
 
     #-------------------------------------------------------------------------------
     def next(self):
         self.logger.debug(f"control: next")
         itunes.next()
+        self.poller.wake()
 
     #-------------------------------------------------------------------------------
     def prev(self):
         self.logger.debug(f"control: prev")
         itunes.prev()
+        self.poller.wake()
 
     #-------------------------------------------------------------------------------
     def back(self):
         self.logger.debug(f"control: back")
         itunes.back()
+        self.poller.wake()
 
 ################################################################################
 class Fader(threading.Thread):
+    # runs any number of fades at once, each targeting the master volume
+    # (itunes.MASTER_VOLUME) or an airplay device by name; steps that come due
+    # together are sent to iTunes as one batched script
 
     #-------------------------------------------------------------------------------
     def __init__(self, plugin):
         super(Fader, self).__init__()
         self.daemon     = True
         self.cancelled  = False
-        self.stopped    = True
-        self.queue      = queue.Queue()
+        self.commands   = list()
+        self.fades      = dict()  # target -> Fade
+        self.latency    = 0.0     # running estimate of a batched volume write round trip
+        self.lock       = threading.Lock()
+        self.event      = threading.Event()  # set by stop, cancel or a new fade
         self.plugin     = plugin
         self.logger     = plugin.logger
         self.start()
 
     #-------------------------------------------------------------------------------
-    def fade(self, volume, duration):
-        self.stopped = True
-        self.queue.put((volume, duration))
-
-    #-------------------------------------------------------------------------------
-    def stop(self):
-        self.stopped = True
-
-    #-------------------------------------------------------------------------------
-    def _fade(self, volume, duration):
-        start_volume = itunes.volume_get()
-        end_volume   = normalize_volume(volume)
-        step_count   = abs(end_volume - start_volume)
-        duration     = float(duration)
-
-        if step_count == 0:
-            # no volume change
-            self.logger.debug('no fade: no volume change')
-        elif duration <= MIN_STEP_TIME:
-            # instant volume change
-            self.logger.debug('no fade: instant volume change')
-            itunes.volume_set(end_volume)
-        else:
-            # actual fade
-
-            # calculate fade steps
-            step_size = up_down = [-1,1][end_volume >= start_volume]
-            step_wait = duration/step_count
-            while step_wait < MIN_STEP_TIME:
-                # ensure minimumAllowed time between steps
-                step_size += up_down
-                step_count = int(abs((end_volume - start_volume)/step_size))
-                step_wait = duration/step_count
-            final_step = (start_volume + step_count * step_size != end_volume)
-
-            # calculate loop timing
-            loop_wait = step_wait
-            while loop_wait > MAX_LOOP_TIME:
-                # loop on multiple of step_wait
-                loop_wait = loop_wait / 2
-
-            # do the fade
-            self.stopped = False
-            self.logger.debug(f'start fade: v{end_volume}/{duration:.4f}s ({step_count}/{step_size:+}/{step_wait:.4f})')
-
-            time_start = time.time()
-            next_step = time_start + step_wait
-            volume = start_volume
-            count = 0
-            while not self.stopped:
-                loop_time = time.time()
-                if loop_time >= next_step:
-                    volume += step_size
-                    count += 1
-                    itunes.volume_set(volume)
-                    next_step += step_wait
-                    if count == step_count:
-                        break
-                time.sleep(max(0, loop_wait - (time.time() - loop_time)))
-            if not self.stopped:
-                if final_step:
-                    volume = end_volume
-                    itunes.volume_set(volume)
-                self.logger.debug(f'end fade:   v{volume}/{time.time()-time_start:.4f}s ({count}/{step_size:+}/{step_wait:.4f})')
+    def fade(self, volume, duration, curve='linear', target=itunes.MASTER_VOLUME):
+        # replaces any fade in progress on the same target
+        with self.lock:
+            self.commands.append(('fade', target, volume, duration, curve))
+        self.event.set()
+
+    #-------------------------------------------------------------------------------
+    def stop(self, target=None):
+        # stop one target, or all fades if no target given
+        with self.lock:
+            self.commands.append(('stop', target))
+        self.event.set()
+
+    #-------------------------------------------------------------------------------
+    def _apply_commands(self):
+        with self.lock:
+            self.event.clear()
+            commands, self.commands = self.commands, list()
+        instant = dict()
+        starting = list()
+        for command in commands:
+            if command[0] == 'stop':
+                for target in ([command[1]] if command[1] is not None else list(self.fades)):
+                    fade = self.fades.pop(target, None)
+                    if fade is not None:
+                        fade.log_end(self.logger, self.latency, stopped=True)
+            else:
+                target, volume, duration, curve = command[1:]
+                self.fades.pop(target, None)
+                if target == itunes.MASTER_VOLUME:
+                    start_volume = itunes.volume_get()
+                else:
+                    start_volume = itunes.airplay_device_volume_get(target)
+                end_volume = normalize_volume(volume)
+                duration = float(duration)
+                name = target or 'master'
+                if start_volume is None:
+                    self.logger.error(f"no fade: cannot get '{name}' volume")
+                elif start_volume == end_volume:
+                    self.logger.debug(f"no fade: '{name}' no volume change")
+                elif duration <= MIN_STEP_TIME:
+                    self.logger.debug(f"no fade: '{name}' instant volume change")
+                    instant[target] = end_volume
+                else:
+                    starting.append((target, start_volume, end_volume, duration, curve))
+        if instant:
+            self._volumes_set(instant)
+
+        # start new fades together, on the same tick as any fades already running
+        time_start = time.monotonic()
+        next_tick = min([fade.deadline for fade in self.fades.values()], default=None)
+        for target, start_volume, end_volume, duration, curve in starting:
+            fade = Fade(target, start_volume, end_volume, duration, curve, self.latency, time_start)
+            if next_tick is not None and next_tick < fade.deadline:
+                fade.deadline = next_tick
+            self.fades[target] = fade
+            self.logger.debug(f"start fade: '{target or 'master'}' v{end_volume}/{duration:.4f}s {curve} ({abs(end_volume-start_volume)}/{fade.step_wait:.4f})")
+
+    #-------------------------------------------------------------------------------
+    def _volumes_set(self, volumes):
+        itunes.volumes_set(volumes)
+        if itunes.MASTER_VOLUME in volumes:
+            self.plugin.airplay.invalidate()
+
+    #-------------------------------------------------------------------------------
+    def _tick(self):
+        # advance every fade that is due, sending all their steps in one call
+        now = time.monotonic()
+        due = [fade for fade in self.fades.values() if fade.deadline <= now + COALESCE_WINDOW]
+        changes = dict()
+        for fade in due:
+            fade.lateness.append(now - fade.deadline)
+            volume = fade.step(now, self.latency)
+            if volume is not None:
+                changes[fade.target] = volume
+        if changes:
+            sent = time.monotonic()
+            self._volumes_set(changes)
+            round_trip = time.monotonic() - sent
+            if self.latency == 0:
+                self.latency = round_trip
+            else:
+                self.latency = (1 - LATENCY_WEIGHT) * self.latency + LATENCY_WEIGHT * round_trip
+        for fade in due:
+            if fade.done:
+                del self.fades[fade.target]
+                fade.log_end(self.logger, self.latency)
             else:
-                self.logger.debug(f'stop fade:  v{volume}/{time.time()-time_start:.4f}s ({count}/{step_size:+}/{step_wait:.4f})')
+                fade.schedule(self.latency)
 
     #-------------------------------------------------------------------------------
     def run(self):
         self.logger.warning("Fader thread started")
         while not self.cancelled:
             try:
-                volume,duration = self.queue.get(True,5)
-                self._fade(volume,duration)
-            except queue.Empty:
-                pass
+                self._apply_commands()
+                if self.fades:
+                    self._tick()
             except Exception as e:
                 msg = f"Fader thread error \n{e}"
                 if self.plugin.debug:
                     self.logger.exception(msg)
                 else:
                     self.logger.error(msg)
+            if self.fades:
+                next_deadline = min(fade.deadline for fade in self.fades.values())
+                self.event.wait(max(0, next_deadline - time.monotonic()))
+            elif not self.cancelled:
+                self.event.wait()
         else:
             self.logger.debug("Fader thread cancelled")
 
     #-------------------------------------------------------------------------------
     def cancel(self):
-        self.stopped = True
         self.cancelled = True
-        while self.is_alive():
-            time.sleep(MAX_LOOP_TIME)
+        self.event.set()
+        self.join()
+
+################################################################################
+class Fade(object):
+    # timing for a single fade target; each write aims at the volume the curve
+    # calls for when the write lands, using the fader's running latency estimate
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, target, start_volume, end_volume, duration, curve, latency, time_start):
+        self.target       = target
+        self.start_volume = start_volume
+        self.end_volume   = end_volume
+        self.volume       = start_volume
+        self.duration     = duration
+        self.curve        = curve
+        self.step_wait    = max(MIN_STEP_TIME, duration/abs(end_volume - start_volume))
+        self.time_start   = time_start
+        self.time_end     = self.time_start + duration
+        self.deadline     = self.time_start
+        self.final        = False
+        self.done         = False
+        self.count        = 0
+        self.lateness     = []
+        curve_function = FADE_CURVES.get(curve, FADE_CURVES['linear'])
+        if end_volume < start_volume:
+            # mirror the curve for fades down
+            curve_function = lambda t, f=curve_function: 1 - f(1 - t)
+        self.curve_function = curve_function
+        self.schedule(latency)
+
+    #-------------------------------------------------------------------------------
+    def step(self, now, latency):
+        # returns the new volume to send, or None if unchanged
+        progress = 1.0 if self.final else min(1.0, (now + latency - self.time_start)/self.duration)
+        self.done = progress >= 1.0
+        volume = int(round(self.start_volume + (self.end_volume - self.start_volume) * self.curve_function(progress)))
+        if volume == self.volume:
+            return None
+        self.volume = volume
+        self.count += 1
+        return volume
+
+    #-------------------------------------------------------------------------------
+    def schedule(self, latency):
+        # never schedule steps faster than the app can take them, and land the last one on time
+        step_interval = max(self.step_wait, latency)
+        now = time.monotonic()
+        self.deadline = max(self.deadline + step_interval, now)
+        if self.deadline + step_interval >= self.time_end - latency:
+            # no room for another step after this one
+            self.deadline = max(self.time_end - latency, now)
+            self.final = True
+
+    #-------------------------------------------------------------------------------
+    def log_end(self, logger, latency, stopped=False):
+        name = self.target or 'master'
+        elapsed = time.monotonic() - self.time_start
+        if stopped:
+            logger.debug(f"stop fade:  '{name}' v{self.volume}/{elapsed:.4f}s ({self.count} steps, latency {latency*1000:.0f} ms)")
+        else:
+            logger.debug(f"end fade:   '{name}' v{self.volume}/{elapsed:.4f}s ({self.count} steps, end error {(elapsed - self.duration)*1000:+.0f} ms, latency {latency*1000:.0f} ms)")
+        if self.lateness:
+            logger.debug(f"fade jitter: '{name}' mean {sum(self.lateness)/len(self.lateness)*1000:.1f} ms, max {max(self.lateness)*1000:.1f} ms over {len(self.lateness)} steps")
+
+################################################################################
+class VolumeQueue(threading.Thread):
+    # relative volume changes are merged into one net change while a write is in
+    # flight, then applied against a locally tracked volume with a single write
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, plugin):
+        super(VolumeQueue, self).__init__()
+        self.daemon     = True
+        self.cancelled  = False
+        self.delta      = 0
+        self.merged     = 0
+        self.volume     = None
+        self.updated    = 0.0
+        self.lock       = threading.Lock()
+        self.event      = threading.Event()
+        self.plugin     = plugin
+        self.logger     = plugin.logger
+        self.start()
+
+    #-------------------------------------------------------------------------------
+    def adjust(self, delta):
+        with self.lock:
+            self.delta += delta
+            self.merged += 1
+        self.event.set()
+
+    #-------------------------------------------------------------------------------
+    def track(self, volume):
+        with self.lock:
+            self.volume = volume
+            self.updated = time.monotonic()
+
+    #-------------------------------------------------------------------------------
+    def forget(self):
+        with self.lock:
+            self.volume = None
+
+    #-------------------------------------------------------------------------------
+    def run(self):
+        self.logger.debug("Volume queue thread started")
+        while not self.cancelled:
+            self.event.wait()
+            with self.lock:
+                self.event.clear()
+                delta, self.delta = self.delta, 0
+                merged, self.merged = self.merged, 0
+                volume = self.volume
+                if time.monotonic() - self.updated > VOLUME_TRACK_TIME:
+                    volume = None
+            if self.cancelled or delta == 0:
+                continue
+            try:
+                if volume is None:
+                    volume = itunes.volume_get()
+                    if volume is None:
+                        self.logger.error("cannot adjust volume: cannot get current volume")
+                        continue
+                self.logger.debug(f"volume queue: {merged} change(s) merged to {delta:+}")
+                self.plugin.volume = volume + delta
+            except Exception as e:
+                msg = f"Volume queue thread error \n{e}"
+                if self.plugin.debug:
+                    self.logger.exception(msg)
+                else:
+                    self.logger.error(msg)
+        else:
+            self.logger.debug("Volume queue thread cancelled")
+
+    #-------------------------------------------------------------------------------
+    def cancel(self):
+        self.cancelled = True
+        self.event.set()
+        self.join()
+
+################################################################################
+class Dispatcher(object):
+    # runs action callbacks on a pool of worker threads; an action waits only for
+    # earlier actions sharing one of its resources, so unrelated actions overlap
+    # and actions on the same resource keep their order
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, plugin, workers=ACTION_WORKERS):
+        self.cancelled  = False
+        self.enabled    = True    # otherwise actions run on the caller's thread
+        self.pending    = list()  # queued actions, oldest first
+        self.busy       = list()  # resources of running actions
+        self.counts     = {'completed':0, 'failed':0}
+        self.condition  = threading.Condition()
+        self.plugin     = plugin
+        self.logger     = plugin.logger
+        self.threads    = [threading.Thread(target=self.run, name=f"iTunesAction{n+1}", daemon=True) for n in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    #-------------------------------------------------------------------------------
+    def submit(self, resources, description, function, *args):
+        item = (resources, description, function, args, time.monotonic())
+        if not self.enabled or self.cancelled:
+            return self._execute(item)
+        with self.condition:
+            self.pending.append(item)
+            self.condition.notify()
+
+    #-------------------------------------------------------------------------------
+    def _next(self):
+        # oldest action whose resources are neither running nor claimed by an older queued action
+        blocked = list(self.busy)
+        for index, item in enumerate(self.pending):
+            if not any(resources_conflict(item[0], resources) for resources in blocked):
+                return self.pending.pop(index)
+            blocked.append(item[0])
+        return None
+
+    #-------------------------------------------------------------------------------
+    def _execute(self, item):
+        resources, description, function, args, queued = item
+        started = time.monotonic()
+        try:
+            function(*args)
+            with self.condition:
+                self.counts['completed'] += 1
+            self.logger.debug(f"action '{description}' done in {(time.monotonic()-started)*1000:.0f} ms (queued {(started-queued)*1000:.0f} ms)")
+        except Exception as e:
+            with self.condition:
+                self.counts['failed'] += 1
+            msg = f"Action '{description}' error \n{e}"
+            if self.plugin.debug:
+                self.logger.exception(msg)
+            else:
+                self.logger.error(msg)
+
+    #-------------------------------------------------------------------------------
+    def run(self):
+        while True:
+            with self.condition:
+                item = self._next()
+                while item is None and not self.cancelled:
+                    self.condition.wait()
+                    item = self._next()
+                if self.cancelled:
+                    return
+                self.busy.append(item[0])
+            try:
+                self._execute(item)
+            finally:
+                with self.condition:
+                    self.busy.remove(item[0])
+                    self.condition.notify_all()
+
+    #-------------------------------------------------------------------------------
+    def cancel(self):
+        with self.condition:
+            self.cancelled = True
+            if self.pending:
+                self.logger.debug(f"Dispatcher cancelled with {len(self.pending)} actions queued")
+            self.pending = list()
+            self.condition.notify_all()
+        # one shared deadline, so shutdown waits at most one script timeout in all
+        deadline = time.monotonic() + itunes.AS_TIMEOUT
+        for thread in self.threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+################################################################################
+class MenuCache(threading.Thread):
+    # lists for config dialog menus, returned from memory at once and refreshed
+    # by this thread when stale or when an action names something not in the list
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, plugin):
+        super(MenuCache, self).__init__()
+        self.daemon     = True
+        self.cancelled  = False
+        self.fetchers   = {
+            'playlists':       plugin.playlist_index.refresh,
+            'airplay_devices': itunes.airplay_devices_all,
+            'eq_presets':      itunes.eq_presets,
+            }
+        self.cache_keys = {
+            'playlists':       'playlists',
+            'airplay_devices': 'airplay_devices_all',
+            'eq_presets':      'eq_presets',
+            }
+        self.lists      = {key:list() for key in self.fetchers}
+        self.updated    = {key:None for key in self.fetchers}
+        self.requested  = {key:0.0 for key in self.fetchers}
+        self.pending    = set(self.fetchers)  # load everything once at startup
+        self.lock       = threading.Lock()
+        self.event      = threading.Event()
+        self.plugin     = plugin
+        self.logger     = plugin.logger
+        self.event.set()
+        self.start()
+
+    #-------------------------------------------------------------------------------
+    def get(self, key):
+        with self.lock:
+            value = list(self.lists[key])
+            updated = self.updated[key]
+        if updated is None or time.monotonic() - updated > MENU_STALE_TIME:
+            self.refresh(key)
+        return value
+
+    #-------------------------------------------------------------------------------
+    def check(self, key, name):
+        # an unknown name means the list is out of date
+        with self.lock:
+            known = self.updated[key] is None or name in self.lists[key]
+        if not known:
+            self.logger.debug(f"menu cache: '{name}' not in {key}")
+            self.refresh(key)
+
+    #-------------------------------------------------------------------------------
+    def refresh(self, key):
+        # rate limited, so a burst of requests causes one refresh
+        now = time.monotonic()
+        with self.lock:
+            if key in self.pending or now - self.requested[key] < MENU_REFRESH_MIN:
+                return
+            self.requested[key] = now
+            self.pending.add(key)
+        self.event.set()
+
+    #-------------------------------------------------------------------------------
+    def run(self):
+        self.logger.debug("Menu cache thread started")
+        while not self.cancelled:
+            self.event.wait()
+            with self.lock:
+                self.event.clear()
+                keys, self.pending = self.pending, set()
+            for key in keys:
+                if self.cancelled:
+                    break
+                try:
+                    itunes.cache_clear(self.cache_keys[key])
+                    value = self.fetchers[key]()
+                    if value is not None:
+                        with self.lock:
+                            self.lists[key] = list(value)
+                            self.updated[key] = time.monotonic()
+                        self.logger.debug(f"menu cache: {key} refreshed ({len(value)} items)")
+                except Exception as e:
+                    msg = f"Menu cache thread error \n{e}"
+                    if self.plugin.debug:
+                        self.logger.exception(msg)
+                    else:
+                        self.logger.error(msg)
+        else:
+            self.logger.debug("Menu cache thread cancelled")
+
+    #-------------------------------------------------------------------------------
+    def cancel(self):
+        self.cancelled = True
+        self.event.set()
+        self.join()
+
+################################################################################
+class PlaylistIndex(object):
+    # playlist names <-> persistent ids, so membership checks need no apple event
+    # and playback addresses playlists by id rather than by name
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, plugin):
+        self.by_name   = dict()
+        self.by_id     = dict()
+        self.names     = list()
+        self.refreshed = None
+        self.lock      = threading.Lock()
+        self.plugin    = plugin
+        self.logger    = plugin.logger
+
+    #-------------------------------------------------------------------------------
+    def refresh(self):
+        # one round trip, then only the differences are applied to the index
+        # returns the playlist names, or None if they could not be read
+        pairs = itunes.playlists_index()
+        if pairs is None:
+            return None
+        with self.lock:
+            current = dict((persistent_id, name) for name, persistent_id in pairs)
+            added   = [pid for pid in current if pid not in self.by_id]
+            removed = [pid for pid in self.by_id if pid not in current]
+            renamed = [pid for pid in current if pid in self.by_id and self.by_id[pid] != current[pid]]
+            for pid in removed + renamed:
+                name = self.by_id.pop(pid)
+                if self.by_name.get(name) == pid:
+                    del self.by_name[name]
+            for pid in added + renamed:
+                self.by_id[pid] = current[pid]
+            # duplicate names resolve to the first playlist with that name
+            for name, pid in reversed(pairs):
+                if pid in added or pid in renamed or name not in self.by_name:
+                    self.by_name[name] = pid
+            self.names = [name for name, pid in pairs]
+            self.refreshed = time.monotonic()
+        if added or removed or renamed:
+            self.logger.debug(f"playlist index: {len(added)} added, {len(removed)} removed, {len(renamed)} renamed")
+        return list(self.names)
+
+    #-------------------------------------------------------------------------------
+    def persistent_id(self, name):
+        # unknown names trigger one refresh, rate limited like the menu cache
+        with self.lock:
+            pid = self.by_name.get(name)
+            refreshed = self.refreshed
+        if pid is None and (refreshed is None or time.monotonic() - refreshed > MENU_REFRESH_MIN):
+            self.refresh()
+            with self.lock:
+                pid = self.by_name.get(name)
+        return pid
+
+    #-------------------------------------------------------------------------------
+    def __contains__(self, name):
+        return self.persistent_id(name) is not None
+
+    #-------------------------------------------------------------------------------
+    def play(self, name):
+        pid = self.persistent_id(name)
+        if pid is not None:
+            if itunes.playlist_play_id(pid):
+                return
+            if isinstance(itunes.last_error(), itunes.ScriptUnavailable):
+                # refused without reaching iTunes, so the id may well be fine
+                return
+        # not indexed or the id is gone, so let iTunes resolve the name
+        self.logger.debug(f"playlist index: playing '{name}' by name")
+        with self.lock:
+            self.refreshed = None
+        itunes.playlist_play(name)
+
+################################################################################
+class TrackIndex(object):
+    # library tracks by persistent id, with a token index over name, artist and
+    # album so play-by-name and fuzzy queries resolve without apple events
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, plugin):
+        self.tracks    = dict()   # persistent id -> (name, artist, album)
+        self.fields    = dict()   # persistent id -> token sets for name, artist, album
+        self.tokens    = dict()   # token -> set of persistent ids
+        self.refreshed = None
+        self.lock      = threading.Lock()  # guards the index, never held across apple events
+        self.building  = threading.Lock()  # one refresh at a time
+        self.plugin    = plugin
+        self.logger    = plugin.logger
+        # built on the first query or by the Rebuild Track Index menu item, so users
+        # without best match actions never enumerate their library
+
+    #-------------------------------------------------------------------------------
+    @property
+    def fresh(self):
+        return self.refreshed is not None and time.monotonic() - self.refreshed <= TRACK_INDEX_TIME
+
+    #-------------------------------------------------------------------------------
+    def __len__(self):
+        return len(self.tracks)
+
+    #-------------------------------------------------------------------------------
+    def refresh(self, full=False):
+        # read every persistent id, then fetch properties only for chunks holding new tracks;
+        # a caller that waited for another refresh uses its result rather than reading again
+        with self.building:
+            if not full and self.fresh:
+                return True
+            ids = itunes.library_track_ids()
+            if ids is None:
+                return False
+            present = set(ids)
+            with self.lock:
+                if full:
+                    self._clear()
+                removed = [pid for pid in self.tracks if pid not in present]
+                for pid in removed:
+                    self._remove(pid)
+                known = set(self.tracks)
+            fetched = 0
+            position = 0
+            while position < len(ids):
+                if ids[position] in known:
+                    position += 1
+                    continue
+                last = min(position + TRACK_CHUNK_SIZE, len(ids))
+                rows = itunes.library_tracks_chunk(position + 1, last)
+                if rows is None:
+                    return False
+                with self.lock:
+                    for pid, name, artist, album in rows:
+                        self._add(pid, name or '', artist or '', album or '')
+                fetched += len(rows)
+                position = last
+            self.refreshed = time.monotonic()
+        if fetched or removed:
+            self.logger.debug(f"track index: {fetched} fetched, {len(removed)} removed, {len(self.tracks)} total")
+        return True
+
+    #-------------------------------------------------------------------------------
+    def _clear(self):
+        self.tracks.clear()
+        self.fields.clear()
+        self.tokens.clear()
+
+    #-------------------------------------------------------------------------------
+    def _add(self, pid, name, artist, album):
+        if pid in self.tracks:
+            self._remove(pid)
+        self.tracks[pid] = (name, artist, album)
+        self.fields[pid] = fields = tuple(set(tokenize(value)) for value in (name, artist, album))
+        for token in set().union(*fields):
+            self.tokens.setdefault(token, set()).add(pid)
+
+    #-------------------------------------------------------------------------------
+    def _remove(self, pid):
+        del self.tracks[pid]
+        for token in set().union(*self.fields.pop(pid)):
+            pids = self.tokens[token]
+            pids.discard(pid)
+            if not pids:
+                del self.tokens[token]
+
+    #-------------------------------------------------------------------------------
+    def best_match(self, query):
+        # returns (persistent id, name, artist, album) of the best match, or None
+        if not self.fresh:
+            self.refresh()
+        query_tokens = tokenize(query)
+        if not query_tokens:
+            return None
+        with self.lock:
+            # each query token matches exactly, else by prefix, else by a close spelling
+            matches = list()
+            for token in query_tokens:
+                if token in self.tokens:
+                    similar = [token]
+                else:
+                    similar = [key for key in self.tokens if key.startswith(token)]
+                    if not similar:
+                        similar = difflib.get_close_matches(token, list(self.tokens), n=3, cutoff=0.8)
+                matches.append(similar)
+            scores = dict()
+            for similar in matches:
+                for pid in set().union(*[self.tokens[key] for key in similar]):
+                    weight = max(weight for weight, field in zip(TRACK_FIELD_WEIGHTS, self.fields[pid])
+                                 if any(key in field for key in similar))
+                    scores[pid] = scores.get(pid, 0.0) + weight
+            if not scores:
+                return None
+            phrase = ' '.join(query_tokens)
+            def rank(pid):
+                name = ' '.join(tokenize(self.tracks[pid][0]))
+                return (scores[pid] + (sum(TRACK_FIELD_WEIGHTS) if name == phrase else 0.0), -len(name))
+            pid = max(scores, key=rank)
+            return (pid,) + self.tracks[pid]
+
+################################################################################
+class SceneStore(object):
+    # named settings snapshots kept in a json file in the plugin's prefs folder; each
+    # scene holds its settings_apply target ready made, so a recall is one apple event
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, plugin):
+        self.scenes  = dict()
+        self.targets = dict()
+        self.lock    = threading.Lock()
+        self.logger  = plugin.logger
+        self.path    = os.path.join(indigo.server.getInstallFolderPath(), 'Preferences', 'Plugins',
+                                    f"{plugin.pluginId}.scenes.json")
+        self.load()
+
+    #-------------------------------------------------------------------------------
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            self.logger.error(f"cannot read scenes from {self.path} ({e})")
+            return
+        with self.lock:
+            for name, packed in data.get('scenes', dict()).items():
+                try:
+                    settings = unpack_settings(packed)
+                    self.targets[name] = settings_target(settings)
+                    self.scenes[name] = settings
+                except (ValueError, KeyError, AttributeError) as e:
+                    self.logger.error(f"scene '{name}' is not valid ({e})")
+        self.logger.debug(f"loaded {len(self.scenes)} scenes from {self.path}")
+
+    #-------------------------------------------------------------------------------
+    def save(self):
+        # write a temporary file and rename it, so a crash never leaves a partial file
+        with self.lock:
+            data = {'v':SNAPSHOT_VERSION, 'scenes':{name:pack_settings(settings) for name, settings in self.scenes.items()}}
+        temp_path = self.path + '.tmp'
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=1, sort_keys=True, ensure_ascii=False)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            self.logger.error(f"cannot write scenes to {self.path} ({e})")
+
+    #-------------------------------------------------------------------------------
+    def store(self, name, settings):
+        target = settings_target(settings)
+        with self.lock:
+            self.scenes[name] = settings
+            self.targets[name] = target
+        self.save()
+
+    #-------------------------------------------------------------------------------
+    def delete(self, name):
+        with self.lock:
+            found = self.scenes.pop(name, None) is not None
+            self.targets.pop(name, None)
+        if found:
+            self.save()
+        return found
+
+    #-------------------------------------------------------------------------------
+    def target(self, name):
+        with self.lock:
+            return self.targets.get(name)
+
+    #-------------------------------------------------------------------------------
+    @property
+    def names(self):
+        with self.lock:
+            return sorted(self.scenes, key=str.casefold)
+
+################################################################################
+class Poller(threading.Thread):
+
+    #-------------------------------------------------------------------------------
+    def __init__(self, plugin):
+        super(Poller, self).__init__()
+        self.daemon     = True
+        self.cancelled  = False
+        self.devices    = dict()  # device id -> poll intervals and last states sent to the server
+        self.lock       = threading.Lock()
+        self.event      = threading.Event()
+        self.plugin     = plugin
+        self.logger     = plugin.logger
+        self.start()
+
+    #-------------------------------------------------------------------------------
+    def add(self, dev):
+        intervals = {key:float(dev.pluginProps.get(key, default)) for key, default in POLL_DEFAULTS.items()}
+        with self.lock:
+            self.devices[dev.id] = {'intervals':intervals, 'states':dict()}
+        self.logger.debug(f"poller: add '{dev.name}'")
+        self.wake()
+
+    #-------------------------------------------------------------------------------
+    def remove(self, dev):
+        with self.lock:
+            self.devices.pop(dev.id, None)
+        self.logger.debug(f"poller: remove '{dev.name}'")
+
+    #-------------------------------------------------------------------------------
+    def wake(self):
+        self.event.set()
+
+    #-------------------------------------------------------------------------------
+    def _poll(self):
+        # only the running check while the app is closed, so polling never launches it
+        status = None
+        if not itunes.running():
+            states = {'playerState':'not running'}
+            interval_key = 'pollNotRunning'
+        elif itunes.breaker_status()['state'] == 'open':
+            # circuit breaker is failing calls fast, poll slowly until it recovers
+            states = {'playerState':'not responding'}
+            interval_key = 'pollNotRunning'
+        else:
+            status = itunes.status_get()
+            if status is None:
+                return POLL_DEFAULTS['pollStopped']
+        if status is not None:
+            states = {
+                'playerState':    status['player_state'] or '',
+                'volume':         status['volume'],
+                'track':          status['track'] or '',
+                'artist':         status['artist'] or '',
+                'album':          status['album'] or '',
+                'playlist':       status['playlist'] or '',
+                'position':       int(status['player_pos'] or 0),
+                'shuffle':        bool(status['shuffle_state']),
+                'repeat':         status['repeat'] or '',
+                'airplayDevices': ', '.join(status['active_devices'] or []),
+                }
+            interval_key = ['pollStopped','pollPlaying'][status['player_state'] == 'playing']
+
+        interval = POLL_IDLE
+        with self.lock:
+            devices = list(self.devices.items())
+        for devId, device in devices:
+            self._update(devId, device['states'], states)
+            interval = min(interval, device['intervals'][interval_key])
+        return interval
+
+    #-------------------------------------------------------------------------------
+    def _update(self, devId, last_states, states):
+        # push only the states that changed since the last update
+        changed = [{'key':key, 'value':value} for key, value in states.items() if last_states.get(key) != value]
+        if changed:
+            indigo.devices[devId].updateStatesOnServer(changed)
+            last_states.update(states)
+            self.logger.debug(f"poller: {devId} updated {[item['key'] for item in changed]}")
+
+    #-------------------------------------------------------------------------------
+    def run(self):
+        self.logger.debug("Poller thread started")
+        while not self.cancelled:
+            self.event.clear()
+            interval = POLL_IDLE
+            try:
+                if self.devices:
+                    interval = self._poll()
+            except Exception as e:
+                msg = f"Poller thread error \n{e}"
+                if self.plugin.debug:
+                    self.logger.exception(msg)
+                else:
+                    self.logger.error(msg)
+            self.event.wait(interval)
+        else:
+            self.logger.debug("Poller thread cancelled")
+
+    #-------------------------------------------------------------------------------
+    def cancel(self):
+        self.cancelled = True
+        self.event.set()
+        self.join()
 
 ################################################################################
 class Airplay(object):
+    # registry of long-lived AirplayDevice objects, one per speaker, whose
+    # selected state and volume are tracked locally and refreshed in one call
 
     #-------------------------------------------------------------------------------
     def __init__(self, plugin):
-        self.plugin = plugin
-        self.logger = plugin.logger
+        self.plugin  = plugin
+        self.logger  = plugin.logger
+        self.devices = dict()
+        self.lock    = threading.Lock()
 
     #-------------------------------------------------------------------------------
     def _getActive(self):
@@ -895,10 +2023,51 @@ class Airplay(object):
         self.logger.debug(f"get active airplay devices: {list(value)}")
         return value
     def _setActive(self,value):
-        self.logger.debug(f"get active airplay devices: {list(value)}")
-        itunes.airplay_devices_active_set(value)
+        self.set_group(dict.fromkeys(value))
     active_devices = property(_getActive,_setActive)
 
+    #-------------------------------------------------------------------------------
+    def set_group(self, devices):
+        # devices maps name -> absolute volume, or None to leave the volume alone
+        self.logger.debug(f"set airplay group: {devices}")
+        for name, volume in devices.items():
+            if volume is not None:
+                self.plugin.fader.stop(name)
+        value = itunes.airplay_group_set(devices)
+        self.logger.debug(f"airplay group now: {value}")
+        if value is not None:
+            self.update_group(value)
+        return value
+
+    #-------------------------------------------------------------------------------
+    def invalidate(self):
+        # airplay device volumes follow the master volume, so after a master volume
+        # write every device is read again
+        with self.lock:
+            for device in self.devices.values():
+                device.updated = 0.0
+
+    #-------------------------------------------------------------------------------
+    def update_group(self, group):
+        # group maps every selected device name -> volume, so all others are deselected
+        now = time.monotonic()
+        for name in group:
+            self.device(name)
+        with self.lock:
+            for name, device in self.devices.items():
+                device.update(name in group, group.get(name, device.level), now)
+
+    #-------------------------------------------------------------------------------
+    def refresh(self):
+        state = itunes.airplay_devices_state_get()
+        if state is None:
+            return False
+        now = time.monotonic()
+        for name, (selected, volume) in state.items():
+            self.device(name).update(selected, volume, now)
+        self.logger.debug(f"refresh airplay devices: {state}")
+        return True
+
     #-------------------------------------------------------------------------------
     @property
     def all_devices(self):
@@ -908,26 +2077,58 @@ class Airplay(object):
 
     #-------------------------------------------------------------------------------
     def device(self,name):
-        return AirplayDevice(name, self.plugin)
+        with self.lock:
+            device = self.devices.get(name)
+            if device is None:
+                device = self.devices[name] = AirplayDevice(name, self)
+        return device
 
 ################################################################################
 class AirplayDevice(object):
+    __slots__ = ('name', 'registry', 'plugin', 'logger', 'selected', 'level', 'updated')
 
     #-------------------------------------------------------------------------------
-    def __init__(self,name,plugin):
-        self.name   = name
-        self.logger = plugin.logger
+    def __init__(self,name,registry):
+        self.name     = name
+        self.registry = registry
+        self.plugin   = registry.plugin
+        self.logger   = registry.logger
+        self.selected = None
+        self.level    = None
+        self.updated  = 0.0
+
+    #-------------------------------------------------------------------------------
+    def update(self, selected, level, now=None):
+        self.selected = selected
+        self.level    = level
+        self.updated  = now or time.monotonic()
+
+    #-------------------------------------------------------------------------------
+    @property
+    def stale(self):
+        return time.monotonic() - self.updated > AIRPLAY_STATE_TIME
+
+    #-------------------------------------------------------------------------------
+    def _fresh(self):
+        # one refresh updates every device in the registry
+        if self.stale:
+            self.registry.refresh()
+        return not self.stale
 
     #-------------------------------------------------------------------------------
     def _getActive(self):
-        value = itunes.airplay_device_active_get(self.name)
+        if self._fresh():
+            value = self.selected
+        else:
+            value = itunes.airplay_device_active_get(self.name)
         self.logger.debug(f"get airplay '{self.name}' status: {value}")
         return value
     def _setActive(self,value):
         self.logger.debug(f"set airplay '{self.name}' status: {value}")
-        try:
-            itunes.airplay_device_active_set(self.name,value)
-        except Exception as e:
+        if itunes.airplay_device_active_set(self.name,value):
+            self.selected = bool(value)
+        else:
+            self.updated = 0.0  # state unknown, read it again next time
             self.logger.error(f"could not set '{self.name}' Airplay status")
     active = property(_getActive,_setActive)
 
@@ -937,15 +2138,102 @@ class AirplayDevice(object):
 
     #-------------------------------------------------------------------------------
     def _getVolume(self):
-        value = itunes.airplay_device_volume_get(self.name)
+        if self._fresh():
+            value = self.level
+        else:
+            value = itunes.airplay_device_volume_get(self.name)
         self.logger.debug(f"get airplay '{self.name}' volume: {value}")
         return value
     def _setVolume(self,value):
-        value = int(normalize_volume(value)/100.0 * itunes.volume_get())
+        master_volume = itunes.volume_get()
+        if master_volume is None:
+            self.logger.error(f"could not set '{self.name}' Airplay volume: cannot get master volume")
+            return
+        value = int(normalize_volume(value)/100.0 * master_volume)
+        self.plugin.fader.stop(self.name)
         self.logger.debug(f"set airplay '{self.name}' volume: {value}")
-        itunes.airplay_device_volume_set(self.name, value)
+        if itunes.airplay_device_volume_set(self.name, value):
+            self.level = value
+        else:
+            self.updated = 0.0  # state unknown, read it again next time
+            self.logger.error(f"could not set '{self.name}' Airplay volume")
     volume = property(_getVolume,_setVolume)
 
+################################################################################
+class VariableWriter(object):
+    # skips writes of the value this plugin last wrote to a variable, so variable
+    # changed triggers only fire on real changes; writes made inside batch() are
+    # held until it ends and each variable is then written once
+
+    #-------------------------------------------------------------------------------
+    def __init__(self):
+        self.values = dict()
+        self.counts = {'issued':0, 'suppressed':0}
+        self.lock   = threading.Lock()
+        self.local  = threading.local()
+
+    #-------------------------------------------------------------------------------
+    def set(self, varId, value):
+        varId, value = int(varId), str(value)
+        pending = getattr(self.local, 'pending', None)
+        if pending is None:
+            self._write(varId, value)
+            return
+        if varId in pending:
+            with self.lock:
+                self.counts['suppressed'] += 1
+        pending[varId] = value
+
+    #-------------------------------------------------------------------------------
+    def _write(self, varId, value):
+        with self.lock:
+            if self.values.get(varId) == value:
+                self.counts['suppressed'] += 1
+                return
+            self.values[varId] = value
+            self.counts['issued'] += 1
+        try:
+            indigo.variable.updateValue(varId, value)
+        except:
+            self.forget(varId)
+            raise
+
+    #-------------------------------------------------------------------------------
+    @contextlib.contextmanager
+    def batch(self):
+        # nested batches join the outermost one
+        if getattr(self.local, 'pending', None) is not None:
+            yield
+            return
+        self.local.pending = dict()
+        try:
+            yield
+        finally:
+            pending, self.local.pending = self.local.pending, None
+            for varId, value in pending.items():
+                self._write(varId, value)
+
+    #-------------------------------------------------------------------------------
+    def changed(self, varId, value):
+        # a variable we have written was changed by someone else
+        with self.lock:
+            if varId in self.values:
+                self.values[varId] = value
+
+    #-------------------------------------------------------------------------------
+    def forget(self, varId):
+        with self.lock:
+            self.values.pop(varId, None)
+
+    #-------------------------------------------------------------------------------
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counts)
+            stats['entries'] = len(self.values)
+        return stats
+
+variable_writer = VariableWriter()
+
 ################################################################################
 # Utilitites
 ################################################################################
@@ -953,6 +2241,12 @@ def zint(value):
     try: return int(value)
     except: return 0
 
+#-------------------------------------------------------------------------------
+def tenths(seconds):
+    if seconds is None:
+        seconds = 0
+    return int(round(seconds * 10))
+
 #-------------------------------------------------------------------------------
 def normalize_volume(value):
     volume = zint(value)
@@ -963,6 +2257,98 @@ def normalize_volume(value):
     else:
         return volume
 
+#-------------------------------------------------------------------------------
+def pack_settings(settings):
+    data = {'v':SNAPSHOT_VERSION}
+    for key, short in SNAPSHOT_KEYS.items():
+        data[short] = settings.get(key)
+    data['ad'] = {name:settings['airplay_volume'].get(name) for name in settings['active_devices']}
+    return data
+
+#-------------------------------------------------------------------------------
+def unpack_settings(data):
+    version = data.get('v')
+    if not isinstance(version, int):
+        raise ValueError("not a settings snapshot")
+    if version > SNAPSHOT_VERSION:
+        raise ValueError(f"snapshot version {version} is newer than this plugin")
+    settings = {key:data.get(short) for key, short in SNAPSHOT_KEYS.items()}
+    devices = data.get('ad') or dict()
+    settings['active_devices'] = list(devices)
+    settings['airplay_volume'] = {name:volume for name, volume in devices.items() if volume is not None}
+    return settings
+
+#-------------------------------------------------------------------------------
+def encode_settings(settings):
+    return json.dumps(pack_settings(settings), separators=(',',':'), ensure_ascii=False)
+
+#-------------------------------------------------------------------------------
+def decode_settings(text):
+    # reads the json format and the str(dict) format written by earlier versions
+    text = text.strip()
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = literal(text)
+    if not isinstance(data, dict):
+        raise ValueError("not a settings snapshot")
+    if data.get('v') is None:
+        missing = [key for key in list(SNAPSHOT_KEYS) + ['active_devices','airplay_volume'] if key not in data]
+        if missing:
+            raise ValueError(f"missing {', '.join(missing)}")
+        return data
+    return unpack_settings(data)
+
+#-------------------------------------------------------------------------------
+def settings_target(settings):
+    # what itunes.settings_apply needs to restore a snapshot, with airplay volumes as absolute values;
+    # the playlist's persistent id is looked up when it is applied
+    volume = normalize_volume(settings['volume'])
+    devices = dict.fromkeys(settings['active_devices'])
+    for name, level in settings['airplay_volume'].items():
+        if name in devices:
+            devices[name] = normalize_volume(level) if volume else 0
+    return {
+        'volume':        volume,
+        'shuffle_state': settings['shuffle_state'],
+        'shuffle_mode':  settings['shuffle_mode'].lower(),
+        'repeat':        settings['repeat'].lower(),
+        'eq_state':      settings['eq_state'],
+        'eq_preset':     settings['eq_preset'],
+        'playlist':      settings['playlist'],
+        'player_state':  settings['player_state'],
+        'devices':       devices,
+        }
+
+#-------------------------------------------------------------------------------
+def decode_devices(text):
+    # device lists are written as 'name, name' for other plugins to read, but json
+    # lists and the "['name', 'name']" form written by earlier versions are also read
+    text = text.strip()
+    if not text:
+        return list()
+    if text.startswith('['):
+        try:
+            devices = json.loads(text)
+        except ValueError:
+            devices = literal(text)
+        return [str(name) for name in devices]
+    return text.split(', ')
+
+#-------------------------------------------------------------------------------
+def resources_conflict(first, second):
+    # 'airplay:*' covers every 'airplay:<device>'
+    for a in first:
+        for b in second:
+            if a == b or (a.endswith('*') and b.startswith(a[:-1])) or (b.endswith('*') and a.startswith(b[:-1])):
+                return True
+    return False
+
+#-------------------------------------------------------------------------------
+def tokenize(text):
+    # lower case words without punctuation, for matching track names
+    return re.findall(r'\w+', str(text).casefold())
+
 #-------------------------------------------------------------------------------
 def variable_get(varId,type=str):
     if type in (bool, int, float, str):
@@ -972,7 +2358,7 @@ def variable_get(varId,type=str):
 
 #-------------------------------------------------------------------------------
 def variable_set(varId,value):
-    indigo.variable.updateValue(int(varId),str(value))
+    variable_writer.set(varId,value)
 
 #-------------------------------------------------------------------------------
 def validateTextFieldNumber(rawInput, numberType=float, zeroAllowed=True, negativeAllowed=True, minimumAllowed=None, maximumAllowed=None):